@@ -0,0 +1,189 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from config import BATCH_WORKERS, BATCH_MAX_PENDING_PER_WORKER
+from parquet_sink import open_parquet_sink
+
+# Chu kỳ kiểm tra job nào đã được process con nhận (để báo on_start)
+_START_POLL_SECONDS = 0.5
+
+def _init_worker(ocr_workers):
+    '''Khởi tạo process con: chia core cho tesseract để không vượt quá số CPU'''
+    from ocr_engine import set_ocr_workers
+    set_ocr_workers(ocr_workers)
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+def _unpack_job(job):
+    '''
+    Job = đường dẫn PDF, hoặc tuple (key, source, filename) với source là
+    đường dẫn / bytes (file Drive tải thẳng vào RAM)
+    '''
+    if isinstance(job, tuple):
+        return job
+    return job, job, os.path.basename(job)
+
+def _extract_job(job, format_type, debug):
+    '''
+    Chạy trong process con: chỉ trích xuất rows (CPU-bound),
+    log được gom lại để process chính hiển thị.
+    '''
+    key, source, filename = _unpack_job(job)
+    logs = []
+    started = time.time()
+    result = {
+        "path": key,
+        "filename": filename,
+        "rows": [],
+        "items": 0,
+        "logs": logs,
+        "error": None,
+        "elapsed": 0.0
+    }
+
+    try:
+        if format_type == "format1":
+            from pdf_processor import extract_pdf_rows
+            rows = extract_pdf_rows(source, logs.append, debug, filename)
+        else:
+            from pdf_processor_format2 import extract_pdf_rows_format2
+            rows = extract_pdf_rows_format2(source, logs.append, debug, filename)
+
+        result["rows"] = rows
+        result["items"] = len(rows)
+    except Exception as e:
+        result["error"] = str(e)
+
+    result["elapsed"] = time.time() - started
+    return result
+
+def open_writer(format_type):
+    '''Phiên ghi Excel theo format (dùng cho cả batch), kèm Parquet nếu bật'''
+    if format_type == "format1":
+        from excel_handler import open_excel_writer
+        writer = open_excel_writer()
+    else:
+        from excel_handler_format2 import open_excel_writer_format2
+        writer = open_excel_writer_format2()
+    # Parquet nhận đúng rows Excel đã thêm, publish theo từng lần lưu workbook
+    writer.mirror = open_parquet_sink(format_type)
+    return writer
+
+def _write_result(result, writer):
+    '''Ghi Excel (+ Parquet qua writer.mirror) - CHỈ chạy ở process chính (1 writer duy nhất)'''
+    if result["error"] or not result["rows"]:
+        return
+
+    try:
+        added, skipped = writer.append_rows(result["rows"])
+        result["added"] = len(added)
+        result["skipped"] = skipped
+    except Exception as e:
+        result["error"] = f"Không thể lưu vào Excel: {e}"
+
+def process_batch(paths, format_type="format1", workers=None, debug=False,
+                  max_pending=None, writer=None, on_start=None):
+    '''
+    Xử lý nhiều PDF song song trên nhiều core.
+
+    - paths: iterable đường dẫn PDF hoặc (key, path/bytes, filename) (có thể là generator, được đọc dần)
+    - workers: số process (mặc định BATCH_WORKERS), <= 1 chạy tuần tự
+    - max_pending: số file tối đa đã submit mà chưa trả kết quả (backpressure)
+    - writer: WorkbookWriter đang mở (None = tự mở và đóng khi xong batch)
+    - on_start: callback(key) khi job bắt đầu chạy (gọi ở process chính)
+    - PARQUET_ENABLED: rows Excel đã thêm được ghi ra Parquet, publish mỗi lần workbook lưu xong
+
+    Yield dict kết quả theo thứ tự hoàn thành:
+    {path (= key của job), filename, rows, items, logs, error, elapsed}
+    + save_error nếu lần lưu checkpoint sau file này bị lỗi (lỗi của writer, không phải của file)
+    '''
+    owns_writer = writer is None
+    if owns_writer:
+        writer = open_writer(format_type)
+
+    try:
+        for result in _run_batch(paths, format_type, workers, debug, max_pending, on_start):
+            _write_result(result, writer)
+            # Lưu checkpoint SAU khi ghi: lỗi lưu không tính vào file vừa xử lý
+            try:
+                writer.checkpoint()
+            except Exception as e:
+                result["save_error"] = f"Không thể lưu Excel (sẽ thử lại): {e}"
+            yield result
+    finally:
+        if owns_writer:
+            writer.close()
+
+def _run_batch(paths, format_type, workers, debug, max_pending, on_start=None):
+    '''Chạy trích xuất (tuần tự hoặc ProcessPool), yield kết quả chưa ghi Excel'''
+    workers = workers or BATCH_WORKERS
+
+    if workers <= 1:
+        for job in paths:
+            if on_start:
+                on_start(_unpack_job(job)[0])
+            yield _extract_job(job, format_type, debug)
+        return
+
+    max_pending = max_pending or workers * BATCH_MAX_PENDING_PER_WORKER
+
+    # Mỗi process con chỉ dùng phần core của mình cho OCR
+    ocr_workers = max(1, (os.cpu_count() or 1) // workers)
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(ocr_workers,)
+    )
+    pending = {}
+    started = set()   # future đã báo on_start
+    path_iter = iter(paths)
+    exhausted = False
+
+    try:
+        while True:
+            # Chỉ lấy thêm file khi còn chỗ → bộ nhớ không tăng theo kích thước batch
+            while not exhausted and len(pending) < max_pending:
+                try:
+                    job = next(path_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                future = pool.submit(_extract_job, job, format_type, debug)
+                pending[future] = job
+
+            if not pending:
+                break
+
+            done, _ = wait(
+                pending,
+                timeout=_START_POLL_SECONDS if on_start else None,
+                return_when=FIRST_COMPLETED
+            )
+
+            # Job đã được process con nhận (running) → báo trạng thái "đang chạy"
+            if on_start:
+                for future, job in pending.items():
+                    if future not in started and (future.running() or future.done()):
+                        started.add(future)
+                        on_start(_unpack_job(job)[0])
+
+            for future in done:
+                started.discard(future)
+                key, _, filename = _unpack_job(pending.pop(future))
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Process con chết (BrokenProcessPool, MemoryError...)
+                    result = {
+                        "path": key,
+                        "filename": filename,
+                        "rows": [],
+                        "items": 0,
+                        "logs": [],
+                        "error": f"Lỗi worker: {e}",
+                        "elapsed": 0.0
+                    }
+
+                yield result
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -7,6 +7,17 @@ import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 EXCEL_FILE = os.path.join(BASE_DIR, "output.xlsx")
 
+# Phiên ghi Excel: lưu sau mỗi N file hoặc T giây (và khi kết thúc batch)
+EXCEL_CHECKPOINT_FILES = 20
+EXCEL_CHECKPOINT_SECONDS = 60
+
+# Tách output thành nhiều shard khi vượt ngưỡng (0 = không giới hạn)
+EXCEL_SHARD_MAX_ROWS = 50000
+EXCEL_SHARD_MAX_BYTES = 10 * 1024 * 1024
+
+# Số dòng cuối hiển thị trên bảng kết quả (tổng số dòng vẫn đếm đủ)
+GUI_PREVIEW_ROWS = 2000
+
 # SERVICE ACCOUNT
 SERVICE_ACCOUNT_FILE = os.path.join(BASE_DIR, 'service_account.json')
 
@@ -15,10 +26,79 @@ LOG_FILE = os.path.join(BASE_DIR, "app_log.txt")
 SUCCESS_FILE = os.path.join(BASE_DIR, "success_log.txt")
 ERROR_FILE = os.path.join(BASE_DIR, "error_log.txt")
 
+# Trạng thái xử lý từng file (SQLite) - success/error log là bản export
+STATE_DB_FILE = os.path.join(BASE_DIR, "processing_state.db")
+
 # Tesseract OCR (optional) - LAZY LOAD
 TESSERACT_PATH = os.path.join(BASE_DIR, "tesseract.exe")
 TESSDATA_PATH = os.path.join(BASE_DIR, "tessdata")
 
+# OCR theo từng trang
+OCR_DPI = 300
+OCR_LANG = "eng"
+OCR_MIN_PAGE_CHARS = 30        # Trang ít hơn số ký tự này = "ít chữ"
+OCR_MIN_IMAGE_COVERAGE = 0.3   # Tỉ lệ diện tích ảnh / trang để coi là trang scan
+OCR_MAX_GARBAGE_RATIO = 0.3    # Tỉ lệ ký tự rác (cid, ký tự lỗi) để coi là text hỏng
+OCR_WORKERS = max(1, min(4, os.cpu_count() or 1))  # Số tiến trình tesseract chạy song song
+OCR_TESSERACT_CONFIG = ""      # Tham số thêm cho tesseract (VD: "--psm 6")
+
+# Cache kết quả OCR trên đĩa (0 = tắt)
+OCR_CACHE_DIR = os.path.join(BASE_DIR, "ocr_cache")
+OCR_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Xử lý batch song song (chừa 1 core cho giao diện)
+BATCH_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+BATCH_MAX_PENDING_PER_WORKER = 2   # Số file tối đa đang chờ / worker (backpressure)
+
+# Số item mỗi trang khi liệt kê Drive (tối đa 1000)
+DRIVE_PAGE_SIZE = 1000
+
+# Endpoint Drive API thay thế (VD: server giả để test: http://localhost:8080), None = Google
+DRIVE_API_ENDPOINT = os.environ.get("DRIVE_API_ENDPOINT") or None
+
+# Quét đệ quy thư mục Drive
+DRIVE_CRAWL_MAX_DEPTH = 10          # Độ sâu tối đa tính từ folder được chọn
+DRIVE_CRAWL_BATCH_PARENTS = 20      # Số folder cha gộp trong 1 query
+DRIVE_CRAWL_WORKERS = 4
+
+# Cache metadata Drive (kết quả liệt kê folder / file)
+DRIVE_CACHE_TTL = 300    # giây, 0 = tắt
+DRIVE_CACHE_SNAPSHOT_FILE = os.path.join(BASE_DIR, "drive_cache.json")   # None = không lưu ra đĩa
+
+# Tìm kiếm tại chỗ trong DriveFilePicker: chỉ vẽ N file khớp đầu tiên mỗi lần gõ (còn lại báo số lượng)
+DRIVE_SEARCH_MAX_ROWS = 500
+
+# Cây folder cho DriveFolderPicker: làm mới nền sau mỗi N giây khi dialog đang mở
+DRIVE_FOLDER_INDEX_REFRESH = 120
+
+# Số request gộp trong 1 HTTP batch (Drive cho phép tối đa 100)
+DRIVE_BATCH_SIZE = 100
+
+# Pool Drive client (mỗi thread 1 client, dùng chung credentials)
+DRIVE_SERVICE_POOL_SIZE = 8     # Số client rảnh giữ lại để dùng lại
+DRIVE_HTTP_TIMEOUT = 60         # giây
+
+# Giới hạn tốc độ + thử lại khi Drive báo quá quota (429 / rateLimitExceeded / 5xx)
+DRIVE_REQUESTS_PER_SECOND = 20  # Quota mặc định 12.000 request / phút; 0 = không giới hạn
+DRIVE_REQUESTS_BURST = 40
+DRIVE_MAX_RETRIES = 6
+DRIVE_BACKOFF_BASE = 1.0        # giây, nhân đôi sau mỗi lần thử lại (có jitter)
+DRIVE_BACKOFF_MAX = 64.0
+
+# Tải file Google Drive song song (prefetch trong lúc parse)
+DRIVE_DOWNLOAD_WORKERS = 4
+DRIVE_PREFETCH_FILES = 8                          # Số file tải trước tối đa
+DRIVE_MAX_INFLIGHT_BYTES = 200 * 1024 * 1024      # Tổng dung lượng đang tải / chờ parse
+DRIVE_SIZE_ESTIMATE = 2 * 1024 * 1024             # Ước lượng khi chưa biết size
+DRIVE_MEMORY_MAX_BYTES = 32 * 1024 * 1024         # File nhỏ hơn tải thẳng vào RAM, lớn hơn ghi ra đĩa (0 = luôn ghi đĩa)
+DRIVE_BLOB_CACHE_DIR = os.path.join(BASE_DIR, "drive_blob_cache")
+DRIVE_BLOB_CACHE_MAX_BYTES = 1024 * 1024 * 1024   # Cache file PDF đã tải, key = file id + md5 (0 = tắt)
+
+# Xuất Parquet song song với Excel khi xử lý batch (cần cài pyarrow)
+PARQUET_ENABLED = False
+PARQUET_DIR = os.path.join(BASE_DIR, "parquet")
+PARQUET_ROW_GROUP_ROWS = 50000
+
 # LAZY IMPORT - Chỉ import khi dùng Google Drive
 GOOGLE_DRIVE_AVAILABLE = None
 
@@ -0,0 +1,173 @@
+import os
+import sys
+import struct
+import hashlib
+from array import array
+from bisect import bisect_left
+
+# Header: magic | version | chữ ký workbook (mtime + size) | số key đã sort | số key append thêm
+_MAGIC = b"PDXK"
+_VERSION = 1
+_HEADER = struct.Struct("<4sI16sqq")
+_KEY_SIZE = 8
+
+# Gộp phần append vào mảng sort khi nó lớn hơn max(COMPACT_MIN, base / COMPACT_RATIO)
+COMPACT_MIN = 4096
+COMPACT_RATIO = 8
+
+def hash_key(key):
+    '''Key chuỗi (filename|po|sku) → số nguyên 64-bit'''
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=_KEY_SIZE).digest()
+    return int.from_bytes(digest, "little")
+
+def source_signature(paths):
+    '''Chữ ký các workbook nguồn dựa trên mtime + size'''
+    h = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        try:
+            st = os.stat(path)
+            h.update(f"{os.path.basename(path)}|{st.st_mtime_ns}|{st.st_size};".encode("utf-8"))
+        except OSError:
+            h.update(f"{os.path.basename(path)}|missing;".encode("utf-8"))
+    return h.digest()
+
+def _to_array(data):
+    keys = array("Q")
+    keys.frombytes(data)
+    if sys.byteorder != "little":
+        keys.byteswap()
+    return keys
+
+def _to_bytes(keys):
+    if sys.byteorder != "little":
+        keys = array("Q", keys)
+        keys.byteswap()
+    return keys.tobytes()
+
+class DedupIndex:
+    '''
+    Index chống trùng lưu cạnh workbook (VD: output.xlsx.keys):
+    - key băm 64-bit: mảng đã sort (tra bằng bisect) + phần append chưa sort
+    - hợp lệ khi chữ ký (mtime + size) khớp workbook, nếu không thì build lại
+    - append tại chỗ sau mỗi lần lưu workbook, không ghi lại toàn bộ file
+    '''
+
+    def __init__(self, index_path, sources_func, keys_func):
+        self.index_path = index_path
+        self.sources_func = sources_func  # () -> list đường dẫn workbook
+        self.keys_func = keys_func        # () -> iterable key chuỗi (dùng khi build lại)
+        self._base = array("Q")
+        self._tail = set()
+        self._tail_on_disk = 0
+        self._unsaved = []
+        self.rebuilt = False
+
+    def load(self):
+        '''Đọc index; build lại nếu thiếu / hỏng / không khớp workbook'''
+        self._base = array("Q")
+        self._tail = set()
+        self._unsaved = []
+        self.rebuilt = False
+
+        signature = source_signature(self.sources_func())
+
+        try:
+            with open(self.index_path, "rb") as f:
+                header = f.read(_HEADER.size)
+                if len(header) == _HEADER.size:
+                    magic, version, saved_sig, base_count, tail_count = _HEADER.unpack(header)
+                    if magic == _MAGIC and version == _VERSION and saved_sig == signature:
+                        base_data = f.read(base_count * _KEY_SIZE)
+                        tail_data = f.read(tail_count * _KEY_SIZE)
+                        if len(base_data) == base_count * _KEY_SIZE and len(tail_data) == tail_count * _KEY_SIZE:
+                            self._base = _to_array(base_data)
+                            self._tail = set(_to_array(tail_data))
+                            self._tail_on_disk = tail_count
+                            return self
+        except OSError:
+            pass
+
+        self.rebuild()
+        return self
+
+    def rebuild(self):
+        '''Build lại index từ workbook'''
+        keys = set()
+        for key in self.keys_func():
+            if key:
+                keys.add(hash_key(key))
+        self._base = array("Q", sorted(keys))
+        self._tail = set()
+        self._unsaved = []
+        self.rebuilt = True
+        self._write_full()
+
+    def __len__(self):
+        return len(self._base) + len(self._tail)
+
+    def _in_base(self, value):
+        i = bisect_left(self._base, value)
+        return i < len(self._base) and self._base[i] == value
+
+    def __contains__(self, key):
+        value = hash_key(key)
+        return value in self._tail or self._in_base(value)
+
+    def add(self, key):
+        '''Thêm key, trả về False nếu đã có'''
+        value = hash_key(key)
+        if value in self._tail or self._in_base(value):
+            return False
+        self._tail.add(value)
+        self._unsaved.append(value)
+        return True
+
+    def discard(self, key):
+        '''Bỏ key vừa add (chưa commit) - khi rows không ghi được vào workbook'''
+        value = hash_key(key)
+        if value in self._unsaved:
+            self._unsaved.remove(value)
+            self._tail.discard(value)
+
+    def commit(self):
+        '''
+        Gọi NGAY SAU khi lưu workbook: append key mới vào cuối file
+        và cập nhật chữ ký theo mtime/size mới của workbook.
+        '''
+        if len(self._tail) > max(COMPACT_MIN, len(self._base) // COMPACT_RATIO):
+            self._base = array("Q", sorted(set(self._base) | self._tail))
+            self._tail = set()
+            self._unsaved = []
+            self._write_full()
+            return
+
+        signature = source_signature(self.sources_func())
+        try:
+            with open(self.index_path, "r+b") as f:
+                f.seek(_HEADER.size + (len(self._base) + self._tail_on_disk) * _KEY_SIZE)
+                f.write(_to_bytes(array("Q", self._unsaved)))
+                f.flush()
+                # Header ghi sau cùng → nếu dừng giữa chừng, phần thừa bị bỏ qua
+                f.seek(0)
+                f.write(_HEADER.pack(_MAGIC, _VERSION, signature, len(self._base),
+                                     self._tail_on_disk + len(self._unsaved)))
+            self._tail_on_disk += len(self._unsaved)
+            self._unsaved = []
+        except OSError:
+            self._write_full()
+
+    def _write_full(self):
+        '''Ghi lại toàn bộ index (atomic)'''
+        signature = source_signature(self.sources_func())
+        tail = array("Q", self._tail)
+        tmp_path = self.index_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, signature, len(self._base), len(tail)))
+                f.write(_to_bytes(self._base))
+                f.write(_to_bytes(tail))
+            os.replace(tmp_path, self.index_path)
+            self._tail_on_disk = len(tail)
+            self._unsaved = []
+        except OSError as e:
+            print(f"Không thể ghi dedup index: {e}")
@@ -1,6 +1,11 @@
+import time
+import threading
 import tkinter as tk
 from tkinter import messagebox
 
+from config import DRIVE_FOLDER_INDEX_REFRESH, DRIVE_SEARCH_MAX_ROWS
+from drive_search import LocalNameSearch
+
 class DriveFilePicker:
     """Dialog chọn file từ Google Drive"""
     
@@ -10,6 +15,13 @@ class DriveFilePicker:
         self.log = log_callback
         self.selected_files = []
         self.current_folder_id = 'root'
+        
+        # Danh sách PDF của folder hiện tại → tìm kiếm tại chỗ khi gõ
+        self.folder_files = []
+        self.file_labels = []
+        self.local_search = LocalNameSearch([])
+        self.listing_complete = False
+        self.shown_query = ""
     
     def show(self):
         """Hiển thị dialog và trả về danh sách file đã chọn"""
@@ -23,6 +35,7 @@ class DriveFilePicker:
         self._load_initial()
         
         self.dialog.wait_window()
+        self.drive_manager.save_cache()
         return self.selected_files
     
     def _create_ui(self):
@@ -84,7 +97,7 @@ class DriveFilePicker:
         tk.Button(
             folder_frame,
             text="🔄",
-            command=self._load_initial,
+            command=self._refresh,
             bg="#95a5a6",
             fg="white",
             font=("Segoe UI", 9, "bold"),
@@ -107,6 +120,7 @@ class DriveFilePicker:
         self.search_entry = tk.Entry(search_frame, width=50, font=("Segoe UI", 10))
         self.search_entry.pack(side=tk.LEFT, padx=5)
         self.search_entry.bind("<Return>", lambda e: self._do_search())
+        self.search_entry.bind("<KeyRelease>", self._on_search_key)
         
         tk.Button(
             search_frame,
@@ -204,6 +218,11 @@ class DriveFilePicker:
         # Load files from first folder
         self._load_files_from_folder(self.folders_data[0][0])
     
+    def _refresh(self):
+        """Tải lại từ Drive (bỏ qua cache)"""
+        self.drive_manager.invalidate_cache()
+        self._load_initial()
+    
     def _on_folder_change(self, event):
         """Khi chọn folder khác"""
         idx = self.folder_combo.current()
@@ -215,17 +234,36 @@ class DriveFilePicker:
     def _load_files_from_folder(self, folder_id):
         """Load PDF files từ folder"""
         self.info_label.config(text="Đang tải...")
-        files = self.drive_manager.list_pdf_files(folder_id)
-        self._display_files(files)
+        self._display_pages(self.drive_manager.iter_pdf_files(folder_id))
+        
+        # Giữ lại danh sách để lọc tại chỗ khi gõ tìm kiếm
+        self.folder_files = list(self.file_listbox.files)
+        self.file_labels = list(self.file_listbox.get(0, tk.END))
+        self.local_search = LocalNameSearch(self.folder_files)
+        self.listing_complete = self.drive_manager.is_listing_complete(folder_id)
+        self.shown_query = ""
+        
+        if self.search_entry.get().strip():
+            self._filter_local()
     
-    def _display_files(self, files):
-        """Hiển thị danh sách file"""
+    def _display_pages(self, pages):
+        """Hiển thị danh sách file theo từng trang (trang đầu hiện ngay)"""
         self.file_listbox.delete(0, tk.END)
+        self.file_listbox.files = []
         
-        if not files:
+        for files in pages:
+            self._append_files(files)
+            self.info_label.config(text=f"Đang tải... {len(self.file_listbox.files)} file PDF")
+            self.dialog.update_idletasks()
+        
+        if not self.file_listbox.files:
             self.info_label.config(text="Không có file PDF nào")
             return
         
+        self.info_label.config(text=f"Tìm thấy {len(self.file_listbox.files)} file PDF")
+    
+    def _append_files(self, files):
+        """Thêm 1 trang file vào listbox"""
         for f in files:
             size_mb = int(f.get('size', 0)) / (1024 * 1024)
             self.file_listbox.insert(
@@ -233,11 +271,46 @@ class DriveFilePicker:
                 f"📄 {f['name']} ({size_mb:.1f} MB)"
             )
         
-        self.file_listbox.files = files
-        self.info_label.config(text=f"Tìm thấy {len(files)} file PDF")
+        self.file_listbox.files.extend(files)
+    
+    def _on_search_key(self, event):
+        """Lọc ngay trên danh sách đã tải mỗi lần gõ (không gọi API)"""
+        # Phím không đổi nội dung (mũi tên, Shift...) → giữ nguyên danh sách + file đang chọn
+        if event.keysym in ("Return", "KP_Enter") or self.search_entry.get().strip() == self.shown_query:
+            return
+        self._filter_local()
+    
+    def _filter_local(self):
+        """Hiển thị file khớp query trong danh sách của folder hiện tại"""
+        query = self.search_entry.get().strip()
+        matches = self.local_search.search(query)
+        self.shown_query = query
+        
+        # Chỉ vẽ lại N dòng đầu → gõ phím không bị khựng khi folder có hàng chục nghìn file
+        shown = matches[:DRIVE_SEARCH_MAX_ROWS]
+        self.file_listbox.delete(0, tk.END)
+        self.file_listbox.files = [self.folder_files[i] for i in shown]
+        if shown:
+            self.file_listbox.insert(tk.END, *[self.file_labels[i] for i in shown])
+        
+        total = len(self.folder_files)
+        if not query:
+            text = f"Tìm thấy {total} file PDF"
+        else:
+            text = f"{len(matches)}/{total} file khớp '{query}'"
+        if len(shown) < len(matches):
+            text += f" - hiển thị {len(shown)} file đầu, gõ thêm để thu hẹp"
+        if query and not self.listing_complete:
+            text += " (danh sách chưa đủ - nhấn Enter để tìm trên Drive)"
+        self.info_label.config(text=text)
     
     def _do_search(self):
         """Tìm kiếm file"""
+        # Đã có đủ danh sách folder → lọc tại chỗ, không gọi API
+        if self.listing_complete:
+            self._filter_local()
+            return
+        
         query = self.search_entry.get().strip()
         if not query:
             self._load_files_from_folder(self.current_folder_id)
@@ -246,8 +319,8 @@ class DriveFilePicker:
         self.info_label.config(text=f"Đang tìm: {query}...")
         self.log(f"🔍 Tìm kiếm: {query}")
         
-        files = self.drive_manager.search_files_in_folder(self.current_folder_id, query)
-        self._display_files(files)
+        self._display_pages(self.drive_manager.iter_search_files(self.current_folder_id, query))
+        self.shown_query = query
     
     def _add_selected(self):
         """Thêm file đã chọn"""
@@ -274,6 +347,7 @@ class DriveFolderPicker:
         self.drive_manager = drive_manager
         self.log = log_callback
         self.selected_files = []
+        self.sync_checkpoint = None  # Mốc Changes API, lưu sau khi xử lý xong selected_files
     
     def show(self):
         """Hiển thị dialog và trả về danh sách file trong folder"""
@@ -288,10 +362,16 @@ class DriveFolderPicker:
         self.folder_name_stack = []  # Stack tên folder
         self.available_folders = []  # Danh sách folders được share
         
+        # Cây folder dựng sẵn → mở / quay lại folder không cần gọi API
+        self.index = self.drive_manager.folder_index
+        self._indexing = False
+        self._last_index_build = 0
+        
         self._create_ui()
         self._load_initial()
         
         self.dialog.wait_window()
+        self.drive_manager.save_cache()
         return self.selected_files
     
     def _create_ui(self):
@@ -394,6 +474,18 @@ class DriveFolderPicker:
             pady=10
         ).pack(side=tk.LEFT, padx=5)
         
+        tk.Button(
+            btn_frame,
+            text="🔄 Chỉ lấy file mới",
+            command=self._sync_folder,
+            bg="#4285f4",
+            fg="white",
+            font=("Segoe UI", 10, "bold"),
+            cursor="hand2",
+            padx=25,
+            pady=10
+        ).pack(side=tk.LEFT, padx=5)
+        
         tk.Button(
             btn_frame,
             text="❌ Hủy",
@@ -425,6 +517,72 @@ class DriveFolderPicker:
         # LƯU DANH SÁCH FOLDERS ĐỂ DÙNG SAU
         self.available_folders = folders
         self.log(f"✅ Tìm thấy {len(folders)} folder được share")
+        
+        # Dựng cây folder của các Shared Drive ở nền (lần đầu dùng cache nếu còn hạn)
+        self.index.add_roots(folders)
+        self._build_index(refresh=False)
+        self.dialog.after(300, self._poll_index)
+    
+    def _build_index(self, refresh):
+        """Liệt kê toàn bộ folder của từng Shared Drive (thread nền) và nạp vào index"""
+        if self._indexing:
+            return
+        drive_ids = list(dict.fromkeys(
+            folder['driveId'] for folder in self.available_folders if folder.get('driveId')
+        ))
+        if not drive_ids:
+            return
+        
+        def worker():
+            total = 0
+            try:
+                for drive_id in drive_ids:
+                    try:
+                        total += self.drive_manager.index_shared_drive(drive_id, refresh=refresh)
+                    except Exception as e:
+                        print(f"Lỗi index folder drive {drive_id}: {e}")
+                self.log(f"🗂️ Đã index {total} thư mục trong {len(drive_ids)} Shared Drive")
+            finally:
+                self._last_index_build = time.time()
+                self._indexing = False
+        
+        self._indexing = True
+        threading.Thread(target=worker, daemon=True, name="drive-folder-index").start()
+    
+    def _poll_index(self):
+        """Vẽ lại folder hiện tại khi index thay đổi + hẹn giờ làm mới index"""
+        if not self.dialog.winfo_exists():
+            return
+        
+        folder_id = self.current_folder_id[0]
+        if folder_id != 'root':
+            children = self.index.children(folder_id)
+            shown = [f['id'] for f in getattr(self.folder_listbox, 'folders', [])]
+            if children is not None and [f['id'] for f in children] != shown:
+                self._display_folders(children)
+        
+        if not self._indexing and time.time() - self._last_index_build >= DRIVE_FOLDER_INDEX_REFRESH:
+            self.index.expire_partial()
+            self._build_index(refresh=True)
+        
+        self.dialog.after(500, self._poll_index)
+    
+    def _subfolders(self, folder_id):
+        """Folder con: lấy từ index, chưa có thì gọi API rồi ghi vào index"""
+        children = self.index.children(folder_id)
+        if children is None:
+            children = self.drive_manager.list_folders(folder_id)
+            if children:  # Rỗng có thể do lỗi API → không ghi vào index
+                self.index.set_children(folder_id, children)
+        return children
+    
+    def _update_path(self):
+        """Đường dẫn folder hiện tại (từ index, không có thì theo các bước đã mở)"""
+        folder_id = self.current_folder_id[0]
+        names = self.index.path(folder_id) if folder_id != 'root' else []
+        if len(names) < len(self.folder_name_stack):
+            names = self.folder_name_stack
+        self.path_var.set(" / ".join(names) if names else "Shared Folders")
     
     def _display_folders(self, folders):
         """Hiển thị folders"""
@@ -459,17 +617,14 @@ class DriveFolderPicker:
                     # Quay về root, hiển thị shared folders
                     folders = self.available_folders
                 else:
-                    folders = self.drive_manager.list_folders(self.current_folder_id[0])
+                    folders = self._subfolders(self.current_folder_id[0])
                 
                 self._display_folders(folders)
                 
                 # Update path
                 if self.folder_name_stack:
                     self.folder_name_stack.pop()
-                    if self.folder_name_stack:
-                        self.path_var.set(" / ".join(self.folder_name_stack))
-                    else:
-                        self.path_var.set("Shared Folders")
+                self._update_path()
             return
         
         # Enter folder
@@ -483,14 +638,55 @@ class DriveFolderPicker:
             
             # Chuyển sang folder mới
             self.current_folder_id[0] = folder['id']
-            self.path_var.set(" / ".join(self.folder_name_stack))
+            self._update_path()
             
             self.log(f"📂 Mở folder: {folder['name']}")
             
             # Load subfolders
-            subfolders = self.drive_manager.list_folders(folder['id'])
+            subfolders = self._subfolders(folder['id'])
             self._display_folders(subfolders)
     
+    def _current_root_ids(self):
+        """Folder gốc để quét: folder hiện tại, hoặc TẤT CẢ shared folders nếu đang ở root"""
+        folder_id = self.current_folder_id[0]
+        if folder_id == 'root':
+            self.log("⚠️ Đang ở root, sẽ lấy file từ TẤT CẢ shared folders...")
+            return [folder['id'] for folder in self.available_folders]
+        return [folder_id]
+    
+    def _sync_folder(self):
+        """Chỉ lấy PDF mới / bị sửa kể từ lần đồng bộ trước (Changes API)"""
+        folder_name = self.folder_name_stack[-1] if self.folder_name_stack else "Shared Folders"
+        self.log(f"🔄 Đồng bộ file mới từ: {folder_name}")
+        self.info_label.config(text="Đang đồng bộ...")
+        self.dialog.update_idletasks()
+        
+        files, full_scan, checkpoint, error = self.drive_manager.sync_changes(
+            self._current_root_ids(), log_callback=self.log
+        )
+        
+        if error:
+            self.log(f"❌ Lỗi đồng bộ: {error}")
+            self.info_label.config(text="❌ Đồng bộ thất bại")
+            messagebox.showerror("Lỗi đồng bộ", f"Không đồng bộ được '{folder_name}':\n{error}")
+            return
+        
+        self.selected_files = [(file['id'], file['name']) for file in files]
+        if files:
+            self.sync_checkpoint = checkpoint
+        else:
+            # Không có file cần xử lý → lưu mốc ngay
+            self.drive_manager.commit_sync(checkpoint)
+        if full_scan:
+            self.log(f"✅ Lần đồng bộ đầu: {len(files)} file PDF (lần sau chỉ lấy file mới)")
+        else:
+            self.log(f"✅ {len(files)} file PDF mới / cập nhật")
+        
+        if not files:
+            messagebox.showinfo("Đồng bộ", f"Không có file PDF mới trong '{folder_name}'")
+        
+        self.dialog.destroy()
+    
     def _select_folder(self):
         """Chọn folder hiện tại"""
         folder_id = self.current_folder_id[0]
@@ -503,21 +699,15 @@ class DriveFolderPicker:
         
         self.log(f"📂 Đang tải file từ: {folder_name} (ID: {folder_id})")
         
-        # QUAN TRỌNG: Nếu folder_id là 'root', lấy từ TẤT CẢ shared folders
-        if folder_id == 'root':
-            self.log("⚠️ Đang ở root, sẽ lấy file từ TẤT CẢ shared folders...")
-            all_files = []
-            
-            for folder in self.available_folders:
-                self.log(f"  📁 Đang quét: {folder['name']}")
-                files = self.drive_manager.list_pdf_files(folder['id'])
-                all_files.extend(files)
-                self.log(f"    → Tìm thấy {len(files)} file")
-            
-            files = all_files
-        else:
-            # Lấy file từ folder cụ thể
-            files = self.drive_manager.list_pdf_files(folder_id)
+        root_ids = self._current_root_ids()
+        
+        # Quét cả subfolder, nhiều folder cha / 1 query, các nhánh chạy song song
+        files = []
+        errors = []
+        for pdfs in self.drive_manager.crawl_pdf_files(root_ids, log_callback=self.log, errors=errors):
+            files.extend(pdfs)
+            self.info_label.config(text=f"Đang quét... {len(files)} file PDF")
+            self.dialog.update_idletasks()
         
         self.selected_files = []
         for file in files:
@@ -525,13 +715,20 @@ class DriveFolderPicker:
         
         self.log(f"✅ Tổng cộng: {len(files)} file PDF")
         
+        if errors:
+            failed = sum(len(chunk) for chunk, _ in errors)
+            messagebox.showwarning(
+                "Thiếu file",
+                f"Không quét được {failed} thư mục trong '{folder_name}' - danh sách có thể thiếu file"
+            )
+        
         if len(files) == 0:
             messagebox.showwarning(
                 "Không có file",
                 f"Không tìm thấy file PDF nào trong '{folder_name}'\n\n"
                 "Kiểm tra:\n"
                 "1. Folder có chứa PDF không?\n"
-                "2. PDF có bị trong subfolder không?\n"
+                "2. PDF có nằm sâu hơn giới hạn quét subfolder không?\n"
                 "3. Service account có quyền truy cập không?"
             )
         
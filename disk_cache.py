@@ -0,0 +1,174 @@
+import os
+import threading
+import uuid
+
+class DiskLRUCache:
+    '''
+    Cache trên đĩa, mỗi key 1 file, giới hạn tổng dung lượng.
+    - LRU theo mtime (chạm lại file mỗi lần hit)
+    - Ghi atomic (file tạm + os.replace) → an toàn khi nhiều process dùng chung
+    - pin: entry đang được dùng (đường dẫn đã giao cho parser) không bị evict tới khi unpin
+    - Đếm hit/miss để báo cáo
+    '''
+
+    def __init__(self, directory, max_bytes, suffix=".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes = None  # Tính lười khi cần
+        self._pinned = {}         # path -> số lần đang pin
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _pin(self, path):
+        '''Gọi khi đang giữ lock'''
+        self._pinned[path] = self._pinned.get(path, 0) + 1
+
+    def unpin(self, key):
+        '''Nhả entry đã pin (get_path / put_file với pin=True)'''
+        path = self._path(key)
+        with self._lock:
+            count = self._pinned.get(path, 0) - 1
+            if count > 0:
+                self._pinned[path] = count
+            else:
+                self._pinned.pop(path, None)
+
+    def get_path(self, key, pin=False):
+        '''Trả về đường dẫn file cache nếu có (đồng thời đánh dấu vừa dùng)'''
+        path = self._path(key)
+        # Kiểm tra + pin trong lock → evict không xóa mất file giữa chừng
+        with self._lock:
+            if os.path.exists(path):
+                self._touch(path)
+                if pin:
+                    self._pin(path)
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+
+    def get(self, key):
+        '''Đọc bytes từ cache, None nếu miss'''
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            # File bị xóa giữa chừng (process khác evict)
+            self.hits -= 1
+            self.misses += 1
+            return None
+
+    def _tmp_path(self, key):
+        folder = os.path.dirname(self._path(key))
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f".{key}.{uuid.uuid4().hex}.tmp")
+
+    def put(self, key, data):
+        '''Ghi bytes vào cache'''
+        try:
+            tmp_path = self._tmp_path(key)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            self._commit(key, tmp_path, len(data))
+        except OSError as e:
+            print(f"Lỗi ghi cache: {e}")
+
+    def put_file(self, key, src_path, pin=False):
+        '''Chuyển 1 file có sẵn vào cache (move, không copy), trả về đường dẫn trong cache'''
+        try:
+            tmp_path = self._tmp_path(key)
+            os.replace(src_path, tmp_path)
+            self._commit(key, tmp_path, os.path.getsize(tmp_path), pin)
+            return self._path(key)
+        except OSError as e:
+            print(f"Lỗi ghi cache: {e}")
+            return None
+
+    def _commit(self, key, tmp_path, size, pin=False):
+        path = self._path(key)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if pin:
+                self._pin(path)
+            if self._total_bytes is not None:
+                self._total_bytes += size
+        if self.total_bytes() > self.max_bytes:
+            self.evict()
+
+    def _scan(self):
+        '''Liệt kê (mtime, size, path) của mọi entry trong cache'''
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self.suffix) or name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def total_bytes(self):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            return self._total_bytes
+
+    def evict(self):
+        '''Xóa entry cũ nhất (LRU) cho tới khi dưới giới hạn dung lượng'''
+        with self._lock:
+            # Quét lại thư mục → đúng cả khi process khác cũng ghi vào cache
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path in self._pinned:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                    self.evictions += 1
+                except OSError:
+                    pass
+            self._total_bytes = total
+
+    def remove(self, key):
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            with self._lock:
+                if self._total_bytes is not None:
+                    self._total_bytes -= size
+        except OSError:
+            pass
+
+    def stats(self):
+        '''Thống kê cache'''
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'bytes': self.total_bytes(),
+            'max_bytes': self.max_bytes
+        }
@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import threading
+
+class MetadataCache:
+    '''
+    Cache metadata Drive trong bộ nhớ, key = chuỗi mô tả query (VD: "pdfs|<folder_id>")
+    - mỗi entry hết hạn sau ttl giây (ttl <= 0 = tắt cache)
+    - xóa chủ động theo điều kiện (invalidate)
+    - tùy chọn lưu snapshot JSON ra đĩa → mở lại app vẫn dùng được nếu chưa hết hạn
+    '''
+
+    def __init__(self, ttl, snapshot_path=None):
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self._entries = {}   # key -> (thời điểm lưu, value)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+        if snapshot_path:
+            self.load()
+
+    def _expired(self, stored_at):
+        return time.time() - stored_at > self.ttl
+
+    def get(self, key):
+        '''Trả về bản sao value, None nếu không có / đã hết hạn'''
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[0]):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            value = entry[1]
+        return list(value) if isinstance(value, list) else value
+
+    def put(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._dirty = True
+
+    def invalidate(self, predicate=None):
+        '''Xóa entry thỏa predicate(key); None = xóa hết'''
+        with self._lock:
+            if predicate is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                keys = [key for key in self._entries if predicate(key)]
+                for key in keys:
+                    del self._entries[key]
+                removed = len(keys)
+            if removed:
+                self._dirty = True
+        return removed
+
+    def load(self):
+        '''Đọc snapshot (bỏ qua entry đã hết hạn)'''
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries = data.get("entries", {})
+            with self._lock:
+                for key, (stored_at, value) in entries.items():
+                    if not self._expired(stored_at):
+                        self._entries[key] = (stored_at, value)
+        except Exception as e:
+            print(f"Lỗi đọc cache Drive: {e}")
+
+    def save(self):
+        '''Ghi snapshot (atomic), chỉ khi có thay đổi'''
+        if not self.snapshot_path or not self._dirty:
+            return
+        with self._lock:
+            entries = {
+                key: [stored_at, value]
+                for key, (stored_at, value) in self._entries.items()
+                if not self._expired(stored_at)
+            }
+            self._dirty = False
+        tmp_path = self.snapshot_path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": 1, "entries": entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"Lỗi ghi cache Drive: {e}")
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
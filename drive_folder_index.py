@@ -0,0 +1,114 @@
+import threading
+
+class FolderTreeIndex:
+    '''
+    Cây thư mục Drive trong bộ nhớ (parent → children), để duyệt folder không cần gọi API:
+    - nạp cả Shared Drive từ 1 lần liệt kê (mọi folder kèm parents)
+    - nạp thêm từng folder (list_folders) cho folder không thuộc drive đã index
+    - version tăng mỗi lần cây thay đổi → UI biết khi nào cần vẽ lại
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._folders = {}     # folder_id -> {'id', 'name', 'parents', 'driveId'}
+        self._children = {}    # parent_id -> [folder_id] (sắp theo tên)
+        self._complete = set() # parent_id đã biết đủ folder con (thuộc drive đã index)
+        self._partial = set()  # parent_id đã biết đủ con nhờ list_folders (hết hạn khi làm mới)
+        self._drives = set()   # drive_id đã index toàn bộ
+        self.version = 0
+
+    def _rebuild(self):
+        '''Dựng lại parent → children từ parents của mọi folder (gọi khi đang giữ lock)'''
+        children = {}
+        for folder in self._folders.values():
+            for parent_id in folder['parents']:
+                children.setdefault(parent_id, []).append(folder['id'])
+        for ids in children.values():
+            ids.sort(key=lambda folder_id: self._folders[folder_id]['name'].lower())
+        self._children = children
+        self.version += 1
+
+    def add_roots(self, folders):
+        '''Ghi nhận folder gốc (shared drives / shared folders) để hiển thị đường dẫn'''
+        with self._lock:
+            for folder in folders:
+                if folder['id'] not in self._folders:
+                    self._folders[folder['id']] = {
+                        'id': folder['id'],
+                        'name': folder['name'],
+                        'parents': [],
+                        'driveId': folder.get('driveId')
+                    }
+
+    def load_drive(self, drive_id, folders):
+        '''Thay toàn bộ folder của 1 Shared Drive (kết quả liệt kê cả drive, có parents)'''
+        with self._lock:
+            for folder_id in [fid for fid, f in self._folders.items()
+                              if f['driveId'] == drive_id and f['parents']]:
+                del self._folders[folder_id]
+            for folder in folders:
+                self._folders[folder['id']] = {
+                    'id': folder['id'],
+                    'name': folder['name'],
+                    'parents': list(folder.get('parents', [])),
+                    'driveId': drive_id
+                }
+            # Trong drive đã index, mọi folder (kể cả root của drive) đều biết đủ con
+            self._complete.add(drive_id)
+            self._complete.update(folder['id'] for folder in folders)
+            self._drives.add(drive_id)
+            self._rebuild()
+
+    def set_children(self, parent_id, folders):
+        '''Ghi nhận folder con của 1 folder (kết quả list_folders)'''
+        with self._lock:
+            for folder in folders:
+                entry = self._folders.get(folder['id'])
+                if entry is None:
+                    entry = self._folders[folder['id']] = {
+                        'id': folder['id'], 'name': folder['name'], 'parents': [], 'driveId': None
+                    }
+                if parent_id not in entry['parents']:
+                    entry['parents'].append(parent_id)
+            self._partial.add(parent_id)
+            self._rebuild()
+
+    def expire_partial(self):
+        '''Bỏ kết quả list_folders từng folder → lần mở sau gọi API lại'''
+        with self._lock:
+            self._partial.clear()
+
+    def children(self, parent_id):
+        '''Folder con (dict id / name), None nếu chưa biết đủ → cần gọi API'''
+        with self._lock:
+            if parent_id not in self._complete and parent_id not in self._partial:
+                return None
+            return [
+                {'id': folder_id, 'name': self._folders[folder_id]['name']}
+                for folder_id in self._children.get(parent_id, [])
+            ]
+
+    def path(self, folder_id):
+        '''Tên các folder từ gốc xuống folder_id (theo parent đầu tiên)'''
+        names = []
+        seen = set()
+        with self._lock:
+            while folder_id in self._folders and folder_id not in seen:
+                seen.add(folder_id)
+                folder = self._folders[folder_id]
+                names.append(folder['name'])
+                folder_id = folder['parents'][0] if folder['parents'] else None
+        names.reverse()
+        return names
+
+    def has_drive(self, drive_id):
+        with self._lock:
+            return drive_id in self._drives
+
+    def stats(self):
+        with self._lock:
+            return {
+                'folders': len(self._folders),
+                'drives': len(self._drives),
+                'version': self.version
+            }
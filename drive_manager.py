@@ -1,110 +1,472 @@
+import io
 import os
-from config import GOOGLE_DRIVE_AVAILABLE, SERVICE_ACCOUNT_FILE
+import json
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import (
+    check_google_drive, SERVICE_ACCOUNT_FILE, DRIVE_PAGE_SIZE,
+    DRIVE_CRAWL_MAX_DEPTH, DRIVE_CRAWL_BATCH_PARENTS, DRIVE_CRAWL_WORKERS,
+    DRIVE_CACHE_TTL, DRIVE_CACHE_SNAPSHOT_FILE, DRIVE_BATCH_SIZE, DRIVE_API_ENDPOINT,
+    DRIVE_SERVICE_POOL_SIZE, DRIVE_HTTP_TIMEOUT
+)
+from drive_cache import MetadataCache
+from drive_folder_index import FolderTreeIndex
+from drive_service_pool import DriveServicePool
+from drive_requests import get_request_executor, is_retryable, is_network_error
 
-if GOOGLE_DRIVE_AVAILABLE:
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+PDF_MIME = 'application/pdf'
+
+# QUAN TRỌNG: Dùng scope .drive.readonly để có quyền đọc TẤT CẢ drives
+SCOPES = [
+    'https://www.googleapis.com/auth/drive.readonly',
+    'https://www.googleapis.com/auth/drive.metadata.readonly'
+]
+
+_google_loaded = False
+_discovery_doc = None          # Discovery document Drive v3 đã parse (dùng chung mọi client)
+_service_account_cache = {}    # (đường dẫn, mtime) -> (info JSON, credentials)
+
+def _load_google():
+    '''Lazy import thư viện Google - chỉ khi dùng Drive lần đầu'''
+    global _google_loaded, httplib2, service_account, AuthorizedHttp
+    global build, build_from_document, MediaIoBaseDownload
+    if _google_loaded:
+        return True
+    if not check_google_drive():
+        return False
+    import httplib2
     from google.oauth2 import service_account
-    from googleapiclient.discovery import build
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build, build_from_document
     from googleapiclient.http import MediaIoBaseDownload
+    _google_loaded = True
+    return True
+
+def _get_discovery_doc():
+    '''Discovery document có sẵn trong googleapiclient (không tải qua mạng), parse 1 lần / process'''
+    global _discovery_doc
+    if _discovery_doc is None:
+        try:
+            from googleapiclient.discovery_cache import get_static_doc
+            content = get_static_doc('drive', 'v3')
+        except ImportError:
+            content = None
+        if content:
+            _discovery_doc = json.loads(content)
+    return _discovery_doc
+
+def _load_service_account():
+    '''(info, credentials) của service account - đọc / parse file 1 lần, đọc lại khi file đổi'''
+    key = (SERVICE_ACCOUNT_FILE, os.path.getmtime(SERVICE_ACCOUNT_FILE))
+    cached = _service_account_cache.get(key)
+    if cached is None:
+        with open(SERVICE_ACCOUNT_FILE, 'r') as f:
+            info = json.load(f)
+        creds = service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
+        cached = (info, creds)
+        _service_account_cache.clear()
+        _service_account_cache[key] = cached
+    return cached
+
+class SpillBuffer:
+    '''
+    Đích ghi cho MediaIoBaseDownload: giữ trong RAM, vượt max_bytes thì
+    chuyển phần đã tải + phần còn lại sang file spill_path.
+    Tính md5 trong lúc ghi để kiểm tra với md5Checksum của Drive.
+    '''
+
+    def __init__(self, max_bytes, spill_path):
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self._memory = io.BytesIO()
+        self._file = None
+
+    @property
+    def in_memory(self):
+        return self._file is None
+
+    def _spill(self):
+        os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+        self._file = open(self.spill_path, 'wb')
+        self._file.write(self._memory.getvalue())
+        self._memory = None
+
+    def write(self, data):
+        if self._file is None and self.size + len(data) > self.max_bytes:
+            self._spill()
+        (self._memory if self._file is None else self._file).write(data)
+        self.md5.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def result(self):
+        '''bytes nếu còn trong RAM, ngược lại là đường dẫn file đã spill'''
+        return self._memory.getvalue() if self._file is None else self.spill_path
+
+def _escape_query(text):
+    '''Escape chuỗi đưa vào query Drive (dấu \\ và dấu nháy đơn)'''
+    return text.replace('\\', '\\\\').replace("'", "\\'")
 
 class GoogleDriveManager:
     '''Quản lý Google Drive với Service Account - Hỗ trợ cả Shared Drives'''
     
     def __init__(self):
         self.service = None
+        self.credentials = None
         self.authenticated = False
         self.service_email = None
+        # Kết quả kiểm tra kết nối (chạy nền sau authenticate)
+        self.connection_checked = threading.Event()
+        self.connection_error = None
+        # Mỗi thread 1 Drive client riêng, dùng chung credentials
+        self.pool = DriveServicePool(self._build_service, DRIVE_SERVICE_POOL_SIZE)
+        # Mọi request đi qua executor chung: giới hạn tốc độ + thử lại khi quá quota
+        self.executor = get_request_executor()
+        # Cache kết quả liệt kê (key = loại query | folder id | ...)
+        self.cache = MetadataCache(DRIVE_CACHE_TTL, DRIVE_CACHE_SNAPSHOT_FILE)
+        # Cây folder (dùng chung cho mọi lần mở DriveFolderPicker)
+        self.folder_index = FolderTreeIndex()
+        # Folder mà lần liệt kê PDF gần nhất đã đọc hết mọi trang, không lỗi
+        self._complete_listings = set()
     
-    def authenticate(self):
-        '''Xác thực với Google Drive qua Service Account'''
-        if not GOOGLE_DRIVE_AVAILABLE:
+    def authenticate(self, on_checked=None):
+        '''
+        Xác thực với Google Drive qua Service Account (không gọi mạng → không treo UI)
+        - credentials + discovery document lấy từ cache trong process
+        - kiểm tra kết nối chạy nền, xong gọi on_checked(ok, message) (từ thread nền)
+        '''
+        if not _load_google():
             return False, "Chưa cài đặt thư viện Google Drive"
         
-        if not os.path.exists(SERVICE_ACCOUNT_FILE):
+        # DRIVE_API_ENDPOINT (server Drive giả để test) không cần service account
+        if not os.path.exists(SERVICE_ACCOUNT_FILE) and not DRIVE_API_ENDPOINT:
             return False, f"Không tìm thấy {SERVICE_ACCOUNT_FILE}\n\nHướng dẫn:\n1. Tạo Service Account tại console.cloud.google.com\n2. Download JSON key\n3. Đổi tên thành 'service_account.json'\n4. Copy vào folder project"
         
         try:
-            # Đọc credentials từ service account file
-            # QUAN TRỌNG: Dùng scope .drive.readonly để có quyền đọc TẤT CẢ drives
-            SCOPES = [
-                'https://www.googleapis.com/auth/drive.readonly',
-                'https://www.googleapis.com/auth/drive.metadata.readonly'
-            ]
-            
-            creds = service_account.Credentials.from_service_account_file(
-                SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+            # Đọc credentials từ service account file (cache theo mtime)
+            if os.path.exists(SERVICE_ACCOUNT_FILE):
+                info, creds = _load_service_account()
+                self.service_email = info.get('client_email')
+            else:
+                from google.auth.credentials import AnonymousCredentials
+                creds = AnonymousCredentials()
             
-            self.service = build('drive', 'v3', credentials=creds)
+            if creds is not self.credentials:
+                self.credentials = creds
+                self.pool.clear()
+            self.service = self._thread_service()
             self.authenticated = True
             
-            # Lấy email của service account
-            self.service_email = self.get_service_account_email()
-            
-            # Test connection
-            self.service.files().list(pageSize=1).execute()
+            self.check_connection_async(on_checked)
             
-            return True, f"✅ Kết nối thành công\n📧 Service Account: {self.service_email}"
+            return True, f"✅ Đã sẵn sàng (đang kiểm tra kết nối...)\n📧 Service Account: {self.service_email}"
             
         except Exception as e:
             return False, f"Lỗi xác thực: {str(e)}\n\nKiểm tra:\n- File service_account.json có đúng không?\n- Đã enable Google Drive API chưa?\n- Đã share folder với service account chưa?"
     
+    def _iter_pages(self, fields, **params):
+        '''
+        Gọi files().list theo từng trang (theo nextPageToken), yield list file của mỗi trang
+        - fields: các field cần lấy của mỗi file (VD: "id, name")
+        '''
+        page_token = None
+        while True:
+            response = self.executor.execute(self._thread_service().files().list(
+                pageSize=DRIVE_PAGE_SIZE,
+                fields=f"nextPageToken, files({fields})",
+                pageToken=page_token,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+                **params
+            ))
+            
+            yield response.get('files', [])
+            
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+    
+    def _cached_pages(self, key, pages):
+        '''
+        Yield từ cache nếu còn hạn (1 trang), nếu không thì gọi API theo trang
+        và chỉ lưu cache khi đã đọc đủ tất cả các trang.
+        '''
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        collected = []
+        for page in pages:
+            collected.extend(page)
+            yield page
+        self.cache.put(key, collected)
+    
+    def invalidate_cache(self, folder_id=None):
+        '''Xóa cache liệt kê của 1 folder / drive (None = xóa hết)'''
+        if folder_id is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(lambda key: folder_id in key.split("|"))
+    
+    def save_cache(self):
+        '''Ghi snapshot cache ra đĩa (nếu bật)'''
+        self.cache.save()
+    
+    def iter_folders(self, parent_id='root'):
+        '''Liệt kê thư mục theo từng trang'''
+        if not self.authenticated:
+            return
+        
+        try:
+            query = f"'{parent_id}' in parents and mimeType='{FOLDER_MIME}' and trashed=false"
+            yield from self._cached_pages(
+                f"folders|{parent_id}",
+                self._iter_pages("id, name", q=query, orderBy="name")
+            )
+        except Exception as e:
+            print(f"Lỗi list folders: {e}")
+    
     def list_folders(self, parent_id='root'):
         '''Liệt kê thư mục'''
+        return [f for page in self.iter_folders(parent_id) for f in page]
+    
+    def iter_pdf_files(self, folder_id='root'):
+        '''Liệt kê PDF theo từng trang (trang đầu có ngay, không chờ cả folder)'''
         if not self.authenticated:
-            return []
+            return
         
+        self._complete_listings.discard(folder_id)
         try:
-            query = f"'{parent_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-            
-            results = self.service.files().list(
-                q=query,
-                pageSize=100,
-                fields="files(id, name)",
-                orderBy="name",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
-            
-            return results.get('files', [])
+            query = f"'{folder_id}' in parents and mimeType='{PDF_MIME}' and trashed=false"
+            yield from self._cached_pages(
+                f"pdfs|{folder_id}",
+                self._iter_pages("id, name, size", q=query, orderBy="name")
+            )
+            self._complete_listings.add(folder_id)
         except Exception as e:
-            print(f"Lỗi list folders: {e}")
-            return []
+            print(f"Lỗi list files: {e}")
     
     def list_pdf_files(self, folder_id='root'):
         '''Liệt kê PDF'''
+        return [f for page in self.iter_pdf_files(folder_id) for f in page]
+    
+    def is_listing_complete(self, folder_id):
+        '''Lần iter_pdf_files gần nhất của folder đã chạy hết mọi trang, không lỗi (kể cả khi tắt cache)'''
+        return folder_id in self._complete_listings
+    
+    def _list_children(self, parent_ids):
+        '''1 query cho nhiều folder cha: PDF + folder con của tất cả parent_ids'''
+        parents = " or ".join(f"'{pid}' in parents" for pid in parent_ids)
+        query = f"({parents}) and (mimeType='{PDF_MIME}' or mimeType='{FOLDER_MIME}') and trashed=false"
+        
+        children = []
+        for page in self._iter_pages("id, name, size, mimeType, parents", q=query):
+            children.extend(page)
+        return children
+    
+    def crawl_pdf_files(self, root_ids, max_depth=DRIVE_CRAWL_MAX_DEPTH,
+                        batch_size=DRIVE_CRAWL_BATCH_PARENTS, workers=DRIVE_CRAWL_WORKERS,
+                        log_callback=None, visited=None, errors=None):
+        '''
+        Tìm PDF trong cả cây thư mục (gồm subfolder), yield từng nhóm PDF tìm được
+        - gộp tối đa batch_size folder cha vào 1 query ('a' in parents or 'b' in parents)
+        - các nhánh độc lập chạy song song (workers luồng)
+        - chống lặp (folder có nhiều cha / shortcut vòng) + giới hạn độ sâu
+        - visited: set nhận id các folder đã quét (khi quét xong)
+        - errors: list nhận (folder ids, lỗi) của nhóm vẫn lỗi sau khi thử lại → cây bị thiếu nhánh đó
+        '''
         if not self.authenticated:
-            return []
+            return
+        
+        log = log_callback or (lambda msg: None)
+        depths = {}          # folder_id -> độ sâu (đồng thời là tập đã thăm)
+        seen_files = set()   # PDF nằm trong nhiều folder chỉ lấy 1 lần
+        pending = deque()
+        for folder_id in root_ids:
+            if folder_id not in depths:
+                depths[folder_id] = 0
+                pending.append(folder_id)
         
+        requests = 0
+        pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="drive-crawl")
+        in_flight = {}
         try:
-            query = f"'{folder_id}' in parents and mimeType='application/pdf' and trashed=false"
-            
-            results = self.service.files().list(
-                q=query,
-                pageSize=1000,
-                fields="files(id, name, size)",
-                orderBy="name",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
-            
-            return results.get('files', [])
+            while pending or in_flight:
+                while pending and len(in_flight) < workers:
+                    chunk = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+                    in_flight[pool.submit(self._list_children, chunk)] = chunk
+                    requests += 1
+                
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = in_flight.pop(future)
+                    try:
+                        children = future.result()
+                    except Exception as e:
+                        print(f"Lỗi crawl folders: {e}")
+                        log(f"  ⚠️ Không quét được {len(chunk)} thư mục: {e}")
+                        if errors is not None:
+                            errors.append((chunk, e))
+                        continue
+                    
+                    chunk_ids = set(chunk)
+                    pdfs = []
+                    for item in children:
+                        if item.get('mimeType') == FOLDER_MIME:
+                            if item['id'] in depths:
+                                continue
+                            depth = 1 + min((depths[p] for p in item.get('parents', []) if p in chunk_ids), default=0)
+                            depths[item['id']] = depth
+                            if depth <= max_depth:
+                                pending.append(item['id'])
+                        elif item['id'] not in seen_files:
+                            seen_files.add(item['id'])
+                            pdfs.append(item)
+                    
+                    if pdfs:
+                        yield pdfs
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        
+        if visited is not None:
+            visited.update(folder_id for folder_id, depth in depths.items() if depth <= max_depth)
+        log(f"  🔎 Đã quét {len(depths)} thư mục, {len(seen_files)} PDF ({requests} request)")
+    
+    def sync_changes(self, root_ids, log_callback=None):
+        '''
+        Đồng bộ tăng dần qua Changes API: chỉ lấy PDF mới / bị sửa từ lần sync trước
+        - startPageToken + danh sách folder con lưu trong state store (theo bộ root_ids)
+        - lần đầu (chưa có token): quét toàn bộ cây thư mục làm mốc
+        Trả về (files, full_scan, checkpoint, error) - checkpoint là mốc mới, CHƯA lưu:
+        gọi commit_sync(checkpoint) sau khi đã xử lý xong files → lỗi giữa chừng
+        thì lần sync sau vẫn lấy lại các file đó.
+        Lỗi (kể cả quét mốc không đủ cây thư mục) → ([], False, None, thông báo lỗi)
+        '''
+        if not self.authenticated:
+            return [], False, None, "Chưa kết nối Google Drive"
+        
+        from state_store import get_state_store
+        
+        log = log_callback or (lambda msg: None)
+        store = get_state_store()
+        scope = ",".join(sorted(root_ids))
+        token_key = f"drive_changes_token|{scope}"
+        folders_key = f"drive_changes_folders|{scope}"
+        
+        try:
+            service = self._thread_service()
+            page_token = store.get_meta(token_key)
+            
+            if not page_token:
+                # Lấy token TRƯỚC khi quét → thay đổi trong lúc quét vẫn có ở lần sync sau
+                start_token = self.executor.execute(service.changes().getStartPageToken(supportsAllDrives=True))
+                folders = set()
+                crawl_errors = []
+                files = [f for pdfs in self.crawl_pdf_files(root_ids, log_callback=log, visited=folders,
+                                                            errors=crawl_errors)
+                         for f in pdfs]
+                # Mốc thiếu nhánh → thay đổi trong nhánh đó không bao giờ khớp folders → không lưu
+                if crawl_errors:
+                    failed = sum(len(chunk) for chunk, _ in crawl_errors)
+                    raise RuntimeError(f"không quét được {failed} thư mục ({crawl_errors[0][1]})")
+                checkpoint = {
+                    folders_key: json.dumps(sorted(folders)),
+                    token_key: start_token['startPageToken']
+                }
+                log(f"  🔖 Đã lấy mốc đồng bộ ({len(folders)} thư mục)")
+                return files, True, checkpoint, None
+            
+            folders = set(json.loads(store.get_meta(folders_key) or "[]")) | set(root_ids)
+            
+            changes = []
+            new_token = None
+            while page_token:
+                response = self.executor.execute(service.changes().list(
+                    pageToken=page_token,
+                    pageSize=DRIVE_PAGE_SIZE,
+                    fields="nextPageToken, newStartPageToken, changes(fileId, removed, "
+                           "file(id, name, size, md5Checksum, modifiedTime, mimeType, parents, trashed))",
+                    spaces='drive',
+                    supportsAllDrives=True,
+                    includeItemsFromAllDrives=True
+                ))
+                changes.extend(response.get('changes', []))
+                page_token = response.get('nextPageToken')
+                new_token = response.get('newStartPageToken', new_token)
+            
+            # Folder trước (folder con mới tạo), sau đó mới tới file
+            for change in changes:
+                f = change.get('file') or {}
+                if f.get('mimeType') == FOLDER_MIME and not change.get('removed') and not f.get('trashed'):
+                    if folders.intersection(f.get('parents', [])):
+                        folders.add(f['id'])
+            
+            files = {}
+            for change in changes:
+                f = change.get('file')
+                if change.get('removed') or not f or f.get('trashed'):
+                    files.pop(change.get('fileId'), None)
+                    continue
+                if f.get('mimeType') == PDF_MIME and folders.intersection(f.get('parents', [])):
+                    files[f['id']] = f
+            
+            checkpoint = {folders_key: json.dumps(sorted(folders))}
+            if new_token:
+                checkpoint[token_key] = new_token
+            
+            log(f"  🔄 {len(changes)} thay đổi, {len(files)} PDF mới / cập nhật")
+            return list(files.values()), False, checkpoint, None
+        
         except Exception as e:
-            print(f"Lỗi list files: {e}")
-            return []
+            print(f"Lỗi sync changes: {e}")
+            return [], False, None, str(e)
+    
+    def commit_sync(self, checkpoint):
+        '''Lưu mốc đồng bộ (từ sync_changes) - chỉ gọi khi các file của lần sync đã xử lý xong'''
+        if not checkpoint:
+            return
+        
+        from state_store import get_state_store
+        
+        store = get_state_store()
+        for key, value in checkpoint.items():
+            store.set_meta(key, value)
     
     def get_shared_drives(self):
         '''Lấy danh sách Shared Drives mà Service Account có quyền truy cập'''
         if not self.authenticated:
             return []
         
+        cached = self.cache.get("drives")
+        if cached is not None:
+            return cached
+        
         try:
             # QUAN TRỌNG: Thêm useDomainAdminAccess=False để lấy ĐÚNG drives mà service account có quyền
-            results = self.service.drives().list(
-                pageSize=100,
-                fields="drives(id, name, capabilities)",
-                useDomainAdminAccess=False
-            ).execute()
-            
-            drives = results.get('drives', [])
+            drives = []
+            page_token = None
+            while True:
+                results = self.executor.execute(self._thread_service().drives().list(
+                    pageSize=100,
+                    fields="nextPageToken, drives(id, name, capabilities)",
+                    pageToken=page_token,
+                    useDomainAdminAccess=False
+                ))
+                
+                drives.extend(results.get('drives', []))
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
             
             # Debug: In ra chi tiết
             print(f"\n🔍 DEBUG: Tìm thấy {len(drives)} Shared Drives:")
@@ -114,6 +476,7 @@ class GoogleDriveManager:
                     caps = drive['capabilities']
                     print(f"    Quyền: canAddChildren={caps.get('canAddChildren')}, canListChildren={caps.get('canListChildren')}")
             
+            self.cache.put("drives", drives)
             return drives
         except Exception as e:
             print(f"Lỗi get shared drives: {e}")
@@ -124,6 +487,10 @@ class GoogleDriveManager:
         if not self.authenticated:
             return []
         
+        cached = self.cache.get("shared_folders")
+        if cached is not None:
+            return cached
+        
         all_folders = []
         
         # 1. LẤY SHARED DRIVES (thư mục dùng chung) - ƯU TIÊN TRƯỚC
@@ -146,18 +513,12 @@ class GoogleDriveManager:
         
         # 2. LẤY FOLDERS TRONG MY DRIVE (shared trực tiếp)
         try:
-            query = "mimeType='application/vnd.google-apps.folder' and sharedWithMe=true and trashed=false"
+            query = f"mimeType='{FOLDER_MIME}' and sharedWithMe=true and trashed=false"
             
-            results = self.service.files().list(
-                q=query,
-                pageSize=100,
-                fields="files(id, name, owners, driveId, capabilities)",
-                orderBy="name",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
-            
-            my_drive_folders = results.get('files', [])
+            my_drive_folders = []
+            for page in self._iter_pages("id, name, driveId, capabilities(canListChildren)",
+                                         q=query, orderBy="name"):
+                my_drive_folders.extend(page)
             
             # Debug: In ra chi tiết
             print(f"\n🔍 DEBUG: Tìm thấy {len(my_drive_folders)} shared folders:")
@@ -185,29 +546,21 @@ class GoogleDriveManager:
         try:
             print(f"\n🔍 DEBUG: Tìm kiếm folders trong tất cả Shared Drives...")
             
-            query = "mimeType='application/vnd.google-apps.folder' and trashed=false"
-            
-            results = self.service.files().list(
-                q=query,
-                corpora='allDrives',  # TÌM TRONG TẤT CẢ DRIVES
-                pageSize=100,
-                fields="files(id, name, driveId, owners)",
-                orderBy="name",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
-            
-            all_drive_folders = results.get('files', [])
+            query = f"mimeType='{FOLDER_MIME}' and trashed=false"
             
             # Lọc chỉ lấy folders có driveId (tức là từ Shared Drives)
             # và chưa có trong danh sách
             existing_ids = {f['id'] for f in all_folders}
             
-            for folder in all_drive_folders:
-                if folder['id'] not in existing_ids and 'driveId' in folder:
-                    folder['source'] = 'Shared Drive Folder'
-                    all_folders.append(folder)
-                    print(f"  + Tìm thấy: {folder['name']} (từ driveId: {folder['driveId']})")
+            for page in self._iter_pages("id, name, driveId", q=query,
+                                         corpora='allDrives',  # TÌM TRONG TẤT CẢ DRIVES
+                                         orderBy="name"):
+                for folder in page:
+                    if folder['id'] not in existing_ids and 'driveId' in folder:
+                        folder['source'] = 'Shared Drive Folder'
+                        all_folders.append(folder)
+                        existing_ids.add(folder['id'])
+                        print(f"  + Tìm thấy: {folder['name']} (từ driveId: {folder['driveId']})")
             
         except Exception as e:
             print(f"Lỗi search in all drives: {e}")
@@ -222,67 +575,189 @@ class GoogleDriveManager:
             print(f"   - Mở Shared Drive → ⚙️ Settings → Manage members")
             print(f"   - Add email: {self.service_email}")
             print(f"   - Chọn role: Viewer hoặc Content Manager\n")
+        else:
+            # Không cache kết quả rỗng → share xong chỉ cần mở lại picker
+            self.cache.put("shared_folders", all_folders)
+            self.cache.save()
         
         return all_folders
     
-    def search_files_in_folder(self, folder_id, query_text=''):
-        '''Tìm kiếm PDF trong folder'''
+    def iter_search_files(self, folder_id, query_text=''):
+        '''Tìm kiếm PDF trong folder theo từng trang'''
         if not self.authenticated:
-            return []
+            return
         
         try:
             if query_text:
-                query = f"'{folder_id}' in parents and name contains '{query_text}' and mimeType='application/pdf' and trashed=false"
+                query = f"'{folder_id}' in parents and name contains '{_escape_query(query_text)}' and mimeType='{PDF_MIME}' and trashed=false"
             else:
-                query = f"'{folder_id}' in parents and mimeType='application/pdf' and trashed=false"
-            
-            results = self.service.files().list(
-                q=query,
-                pageSize=100,
-                fields="files(id, name, size)",
-                orderBy="name",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
+                query = f"'{folder_id}' in parents and mimeType='{PDF_MIME}' and trashed=false"
             
-            return results.get('files', [])
+            yield from self._cached_pages(
+                f"search|{folder_id}|{query_text}",
+                self._iter_pages("id, name, size", q=query, orderBy="name")
+            )
         except Exception as e:
             print(f"Lỗi search files: {e}")
-            return []
     
-    def download_file(self, file_id, destination_path):
-        '''Download file từ Drive'''
+    def search_files_in_folder(self, folder_id, query_text=''):
+        '''Tìm kiếm PDF trong folder'''
+        return [f for page in self.iter_search_files(folder_id, query_text) for f in page]
+    
+    def check_connection_async(self, on_checked=None):
+        '''Test kết nối (1 request nhỏ, đồng thời lấy access token) trong thread nền'''
+        self.connection_checked.clear()
+        self.connection_error = None
+        
+        def worker():
+            try:
+                self.executor.execute(self._thread_service().files().list(pageSize=1))
+                ok, message = True, "✅ Kết nối Google Drive thành công"
+            except Exception as e:
+                # Lỗi credentials / quyền → lần sau xác thực lại từ đầu
+                # Mất mạng (DNS, socket, httplib2, transport) / server tạm lỗi → vẫn giữ
+                # trạng thái, danh sách trong cache vẫn dùng được
+                self.connection_error = str(e)
+                offline = is_network_error(e) or isinstance(e, (OSError, httplib2.HttpLib2Error))
+                if not (offline or is_retryable(e)):
+                    self.authenticated = False
+                ok = False
+                message = f"Lỗi kết nối Google Drive: {e}\n\nKiểm tra:\n- File service_account.json có đúng không?\n- Đã enable Google Drive API chưa?\n- Đã share folder với service account chưa?"
+            finally:
+                self.pool.release()
+                self.connection_checked.set()
+            if on_checked:
+                on_checked(ok, message)
+        
+        threading.Thread(target=worker, daemon=True, name="drive-probe").start()
+    
+    def _build_service(self):
+        '''
+        Tạo Drive client (trỏ tới DRIVE_API_ENDPOINT nếu có cấu hình)
+        - dùng discovery document có sẵn (không tải qua mạng, parse 1 lần)
+        - mỗi client có httplib2.Http riêng → giữ kết nối mở cho các request sau
+        '''
+        client_options = {'api_endpoint': DRIVE_API_ENDPOINT} if DRIVE_API_ENDPOINT else None
+        http = AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=DRIVE_HTTP_TIMEOUT))
+        doc = _get_discovery_doc()
+        if doc is not None:
+            return build_from_document(doc, http=http, client_options=client_options)
+        return build('drive', 'v3', http=http,
+                     cache_discovery=False, client_options=client_options)
+    
+    def _thread_service(self):
+        '''Service riêng cho thread hiện tại (httplib2 không dùng chung được giữa các thread)'''
+        return self.pool.get()
+    
+    def download_to_buffer(self, file_id, spill_path, max_memory_bytes, size=None, md5=None):
+        '''
+        Download file vào RAM (không ghi đĩa), trả về bytes.
+        File lớn hơn max_memory_bytes được ghi ra spill_path và trả về đường dẫn.
+        md5: md5Checksum của Drive → kiểm tra trong lúc tải, sai thì coi như lỗi.
+        Trả về None nếu lỗi.
+        '''
         if not self.authenticated:
-            return False
+            return None
         
+        # Biết trước là file lớn → ghi thẳng ra đĩa
         try:
-            request = self.service.files().get_media(
+            if size and int(size) > max_memory_bytes:
+                max_memory_bytes = 0
+        except (TypeError, ValueError):
+            pass
+        
+        buffer = SpillBuffer(max_memory_bytes, spill_path)
+        try:
+            request = self._thread_service().files().get_media(
                 fileId=file_id,
                 supportsAllDrives=True
             )
             
-            with open(destination_path, 'wb') as f:
-                downloader = MediaIoBaseDownload(f, request)
-                done = False
-                while not done:
-                    status, done = downloader.next_chunk()
-            
-            return True
+            downloader = MediaIoBaseDownload(buffer, request)
+            done = False
+            while not done:
+                status, done = self.executor.call(downloader.next_chunk)
+            
+            buffer.close()
+            if md5 and buffer.md5.hexdigest() != md5:
+                print(f"Lỗi download: sai md5 ({file_id})")
+                if not buffer.in_memory:
+                    os.remove(spill_path)
+                return None
+            return buffer.result()
         except Exception as e:
+            buffer.close()
             print(f"Lỗi download: {e}")
-            return False
+            return None
     
     def search_files(self, query_text, folder_id='root'):
         '''Tìm kiếm file (backward compatibility)'''
         return self.search_files_in_folder(folder_id, query_text)
     
+    def get_files_metadata(self, file_ids, fields="id, name, size, md5Checksum, modifiedTime"):
+        '''
+        Lấy metadata nhiều file bằng HTTP batch (tối đa DRIVE_BATCH_SIZE files.get / 1 round trip)
+        Trả về dict file_id -> metadata (file lỗi / không có quyền bị bỏ qua)
+        File bị 429 / rateLimitExceeded trong batch được gửi lại (backoff) ở batch sau.
+        '''
+        if not self.authenticated:
+            return {}
+        
+        metadata = {}
+        errors = []
+        failed = {}
+        
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                failed[request_id] = exception
+            else:
+                metadata[request_id] = response
+        
+        def run_batch(chunk):
+            batch = service.new_batch_http_request(callback=on_response)
+            for file_id in chunk:
+                batch.add(
+                    service.files().get(fileId=file_id, fields=fields, supportsAllDrives=True),
+                    request_id=file_id
+                )
+            batch.execute()
+        
+        file_ids = list(dict.fromkeys(file_ids))
+        service = self._thread_service()
+        for start in range(0, len(file_ids), DRIVE_BATCH_SIZE):
+            chunk = file_ids[start:start + DRIVE_BATCH_SIZE]
+            attempt = 0
+            while chunk:
+                failed.clear()
+                try:
+                    # Mỗi request trong batch tính riêng vào quota
+                    self.executor.call(lambda: run_batch(chunk), cost=len(chunk))
+                except Exception as e:
+                    print(f"Lỗi batch metadata: {e}")
+                    break
+                
+                retry = [file_id for file_id, exc in failed.items() if is_retryable(exc)]
+                errors.extend((file_id, exc) for file_id, exc in failed.items()
+                              if file_id not in retry or attempt >= self.executor.max_retries)
+                if not retry or attempt >= self.executor.max_retries:
+                    break
+                self.executor.backoff(attempt)
+                attempt += 1
+                chunk = retry
+        
+        for file_id, exception in errors:
+            print(f"Lỗi metadata {file_id}: {exception}")
+        
+        return metadata
+    
     def get_service_account_email(self):
-        '''Lấy email của service account'''
+        '''Lấy email của service account (đã đọc lúc xác thực → không đọc lại file)'''
+        if self.service_email:
+            return self.service_email
         if not os.path.exists(SERVICE_ACCOUNT_FILE):
             return None
         
         try:
-            import json
             with open(SERVICE_ACCOUNT_FILE, 'r') as f:
                 data = json.load(f)
                 return data.get('client_email')
@@ -295,11 +770,11 @@ class GoogleDriveManager:
             return None
         
         try:
-            file = self.service.files().get(
+            file = self.executor.execute(self._thread_service().files().get(
                 fileId=folder_id,
                 fields="id, name, permissions, owners, driveId",
                 supportsAllDrives=True
-            ).execute()
+            ))
             
             return file
         except Exception as e:
@@ -314,20 +789,9 @@ class GoogleDriveManager:
         try:
             # QUAN TRỌNG: Không dùng "in parents" cho root của Shared Drive
             # Thay vào đó, search tất cả folders trong drive đó
-            query = f"mimeType='application/vnd.google-apps.folder' and trashed=false"
-            
-            results = self.service.files().list(
-                q=query,
-                corpora='drive',  # Chỉ tìm trong Shared Drive này
-                driveId=drive_id,
-                pageSize=100,
-                fields="files(id, name, parents)",
-                orderBy="name",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
-            
-            folders = results.get('files', [])
+            folders = []
+            for page in self._drive_folder_pages(drive_id):
+                folders.extend(page)
             
             # Lọc chỉ lấy folders ở root level (không có parents hoặc parents là drive_id)
             root_folders = []
@@ -349,21 +813,40 @@ class GoogleDriveManager:
             return []
         
         try:
-            query = f"mimeType='application/vnd.google-apps.folder' and trashed=false"
-            
-            results = self.service.files().list(
-                q=query,
-                corpora='drive',
-                driveId=drive_id,
-                pageSize=1000,
-                fields="files(id, name, parents)",
-                orderBy="name",
-                supportsAllDrives=True,
-                includeItemsFromAllDrives=True
-            ).execute()
+            folders = []
+            for page in self._drive_folder_pages(drive_id):
+                folders.extend(page)
             
-            return results.get('files', [])
+            return folders
             
         except Exception as e:
             print(f"Lỗi list all folders: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    def _drive_folder_pages(self, drive_id):
+        '''Mọi folder của Shared Drive (kèm parents) theo từng trang - 1 query cho cả drive'''
+        query = f"mimeType='{FOLDER_MIME}' and trashed=false"
+        pages = self._iter_pages("id, name, parents", q=query,
+                                 corpora='drive',  # Chỉ tìm trong Shared Drive này
+                                 driveId=drive_id, orderBy="name")
+        return self._cached_pages(f"drive_folders|{drive_id}", pages)
+    
+    def index_shared_drive(self, drive_id, refresh=False):
+        '''
+        Nạp cả cây folder của Shared Drive vào folder_index
+        - refresh=True: bỏ qua cache, liệt kê lại từ API
+        - lỗi API → raise, index cũ giữ nguyên
+        '''
+        if not self.authenticated:
+            return 0
+        
+        if refresh:
+            key = f"drive_folders|{drive_id}"
+            self.cache.invalidate(lambda k: k == key)
+        
+        folders = []
+        for page in self._drive_folder_pages(drive_id):
+            folders.extend(page)
+        
+        self.folder_index.load_drive(drive_id, folders)
+        return len(folders)
\ No newline at end of file
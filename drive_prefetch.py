@@ -0,0 +1,223 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import (
+    DRIVE_DOWNLOAD_WORKERS, DRIVE_PREFETCH_FILES,
+    DRIVE_MAX_INFLIGHT_BYTES, DRIVE_SIZE_ESTIMATE, DRIVE_MEMORY_MAX_BYTES,
+    DRIVE_BLOB_CACHE_DIR, DRIVE_BLOB_CACHE_MAX_BYTES
+)
+from disk_cache import DiskLRUCache
+
+_blob_cache = None
+
+def get_blob_cache():
+    '''Cache file Drive đã tải (None nếu tắt)'''
+    global _blob_cache
+    if _blob_cache is None and DRIVE_BLOB_CACHE_MAX_BYTES > 0:
+        _blob_cache = DiskLRUCache(DRIVE_BLOB_CACHE_DIR, DRIVE_BLOB_CACHE_MAX_BYTES, suffix=".pdf")
+    return _blob_cache
+
+def blob_cache_key(file_id, md5):
+    '''Key cache = file id + md5Checksum → file bị sửa trên Drive thì key đổi'''
+    return f"{file_id}_{md5}"
+
+class DrivePrefetcher:
+    '''
+    Tải trước file Drive song song trong lúc file trước đang được parse:
+    - tối đa `workers` file tải cùng lúc, `prefetch` file đã submit chưa giao cho parser
+    - tổng dung lượng đang tải / chờ giao <= max_inflight_bytes (luôn cho phép ít nhất 1 file)
+    - trả kết quả theo thứ tự tải xong (không chờ file đứng trước)
+    - file <= memory_max_bytes tải thẳng vào RAM (data), lớn hơn thì ghi ra dest_path
+    - có md5 → dùng lại bản trong blob_cache nếu md5 trên Drive không đổi
+    - path nằm trong cache được pin (không bị evict) tới khi release(file_id)
+
+    items: iterable (key, file_id, dest_path, size, md5) - size None = dùng ước lượng
+    '''
+
+    def __init__(self, manager, items, workers=DRIVE_DOWNLOAD_WORKERS,
+                 prefetch=DRIVE_PREFETCH_FILES, max_inflight_bytes=DRIVE_MAX_INFLIGHT_BYTES,
+                 size_estimate=DRIVE_SIZE_ESTIMATE, memory_max_bytes=DRIVE_MEMORY_MAX_BYTES,
+                 blob_cache=None):
+        self.manager = manager
+        self.items = iter(items)
+        self.workers = max(1, workers)
+        self.prefetch = max(self.workers, prefetch)
+        self.max_inflight_bytes = max_inflight_bytes
+        self.size_estimate = size_estimate
+        self.memory_max_bytes = memory_max_bytes
+        self.blob_cache = blob_cache
+
+        self._pool = None
+        self._pending = {}      # future -> (item, bytes giữ chỗ)
+        self._next_item = None  # item đã lấy ra nhưng chưa đủ chỗ để submit
+        self._exhausted = False
+        self._pinned = []       # (file_id, cache_key) đã giao path trong cache, chưa release
+        self._lock = threading.Lock()
+
+        self.inflight_bytes = 0
+        self.max_inflight_seen = 0
+        self.files_downloaded = 0
+        self.bytes_downloaded = 0
+        self.cache_hits = 0
+
+    def start(self):
+        '''Bắt đầu tải ngay (không chờ vòng lặp đầu tiên)'''
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="drive-download")
+            self._fill()
+        return self
+
+    def _reserve_size(self, item):
+        size = item[3]
+        try:
+            return int(size) if size else self.size_estimate
+        except (TypeError, ValueError):
+            return self.size_estimate
+
+    def _fill(self):
+        while len(self._pending) < self.prefetch:
+            if self._next_item is None:
+                if self._exhausted:
+                    return
+                try:
+                    self._next_item = next(self.items)
+                except StopIteration:
+                    self._exhausted = True
+                    return
+
+            reserved = self._reserve_size(self._next_item)
+            if self._pending and self.inflight_bytes + reserved > self.max_inflight_bytes:
+                return
+
+            item = self._next_item
+            self._next_item = None
+            with self._lock:
+                self.inflight_bytes += reserved
+                self.max_inflight_seen = max(self.max_inflight_seen, self.inflight_bytes)
+            future = self._pool.submit(self._download, item)
+            self._pending[future] = (item, reserved)
+
+    def _from_cache(self, cache_key):
+        '''File nhỏ đọc vào RAM, file lớn dùng thẳng đường dẫn trong cache (pin tới khi release)'''
+        path = self.blob_cache.get_path(cache_key, pin=True)
+        if path is None:
+            return None
+        try:
+            if os.path.getsize(path) <= self.memory_max_bytes:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                self.blob_cache.unpin(cache_key)
+                return data
+            return path
+        except OSError:
+            self.blob_cache.unpin(cache_key)
+            return None
+
+    def _to_cache(self, cache_key, downloaded):
+        '''Lưu file vừa tải vào cache, trả về bytes / đường dẫn mới (nếu file đã chuyển vào cache)'''
+        if isinstance(downloaded, bytes):
+            self.blob_cache.put(cache_key, downloaded)
+            return downloaded
+        return self.blob_cache.put_file(cache_key, downloaded, pin=True) or downloaded
+
+    def release(self, file_id=None):
+        '''Parser đã dùng xong file (None = tất cả) → entry cache được evict bình thường'''
+        with self._lock:
+            if file_id is None:
+                released, self._pinned = self._pinned, []
+            else:
+                released = [entry for entry in self._pinned if entry[0] == file_id][:1]
+                for entry in released:
+                    self._pinned.remove(entry)
+        for _, cache_key in released:
+            self.blob_cache.unpin(cache_key)
+
+    def _download(self, item):
+        key, file_id, dest_path, size_hint, md5 = item
+        started = time.time()
+        cache_key = blob_cache_key(file_id, md5) if self.blob_cache is not None and md5 else None
+
+        downloaded = self._from_cache(cache_key) if cache_key else None
+        from_cache = downloaded is not None
+        cached = from_cache and not isinstance(downloaded, bytes)
+
+        if not from_cache:
+            # memory_max_bytes = 0 → ghi thẳng ra dest_path (vẫn kiểm tra md5)
+            downloaded = self.manager.download_to_buffer(
+                file_id, dest_path, self.memory_max_bytes, size_hint, md5
+            )
+            if downloaded and cache_key:
+                downloaded = self._to_cache(cache_key, downloaded)
+                cached = not isinstance(downloaded, bytes) and downloaded != dest_path
+
+        data = downloaded if isinstance(downloaded, bytes) else None
+        path = downloaded if downloaded and data is None else None
+        if cached:
+            with self._lock:
+                self._pinned.append((file_id, cache_key))
+
+        size = 0
+        if data is not None:
+            size = len(data)
+        elif path:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                pass
+        return {
+            "key": key,
+            "file_id": file_id,
+            "path": path,
+            "data": data,
+            "ok": data is not None or path is not None,
+            "from_cache": from_cache,
+            "cached": cached,   # path nằm trong cache → không được xóa sau khi parse
+            "bytes": size,
+            "elapsed": time.time() - started
+        }
+
+    def __iter__(self):
+        '''Yield dict {key, file_id, path, data, ok, from_cache, cached, bytes, elapsed} theo thứ tự tải xong'''
+        self.start()
+        try:
+            while self._pending:
+                done, _ = wait(self._pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item, reserved = self._pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        print(f"Lỗi download: {e}")
+                        result = {
+                            "key": item[0], "file_id": item[1], "path": None, "data": None,
+                            "ok": False, "from_cache": False, "cached": False, "bytes": 0, "elapsed": 0.0
+                        }
+                    if result["ok"]:
+                        self.files_downloaded += 1
+                        self.bytes_downloaded += result["bytes"]
+                    if result.get("from_cache"):
+                        self.cache_hits += 1
+
+                    yield result
+
+                    # Đã giao cho parser → nhả chỗ cho file tiếp theo
+                    with self._lock:
+                        self.inflight_bytes -= reserved
+                self._fill()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pending.clear()
+
+    def stats(self):
+        return {
+            'files': self.files_downloaded,
+            'bytes': self.bytes_downloaded,
+            'cache_hits': self.cache_hits,
+            'max_inflight_bytes': self.max_inflight_seen
+        }
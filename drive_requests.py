@@ -0,0 +1,184 @@
+import time
+import random
+import socket
+import ssl
+import threading
+
+from config import (
+    DRIVE_REQUESTS_PER_SECOND, DRIVE_REQUESTS_BURST,
+    DRIVE_MAX_RETRIES, DRIVE_BACKOFF_BASE, DRIVE_BACKOFF_MAX
+)
+
+# HTTP status Drive trả về khi quá tải / lỗi tạm thời → thử lại được
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = ("ratelimitexceeded", "userratelimitexceeded")
+
+# Mất mạng / DNS / timeout / SSL (socket.timeout = TimeoutError từ Python 3.10)
+NETWORK_ERRORS = (ConnectionError, TimeoutError, socket.timeout, socket.gaierror, ssl.SSLError)
+# Lỗi mạng của httplib2 / google-auth: nhận theo (module, tên lớp) → không cần import thư viện Google
+NETWORK_ERROR_CLASSES = {
+    ("httplib2", "ServerNotFoundError"),
+    ("google.auth.exceptions", "TransportError"),
+}
+
+def _http_status(exc):
+    '''Status của HttpError (googleapiclient), None nếu không phải lỗi HTTP'''
+    resp = getattr(exc, 'resp', None)
+    try:
+        return int(getattr(resp, 'status', None))
+    except (TypeError, ValueError):
+        return None
+
+def is_rate_limited(exc):
+    '''429 hoặc 403 rateLimitExceeded / userRateLimitExceeded'''
+    status = _http_status(exc)
+    if status == 429:
+        return True
+    if status == 403:
+        content = getattr(exc, 'content', b'') or b''
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='ignore')
+        return any(reason in content.lower() for reason in RATE_LIMIT_REASONS)
+    return False
+
+def is_network_error(exc):
+    '''Không tới được server (mất mạng, sai DNS, timeout, lỗi SSL) - không phải lỗi quyền / dữ liệu'''
+    if isinstance(exc, NETWORK_ERRORS):
+        return True
+    return any((cls.__module__, cls.__name__) in NETWORK_ERROR_CLASSES for cls in type(exc).__mro__)
+
+def is_retryable(exc):
+    '''Lỗi tạm thời: quá quota, lỗi server, mất kết nối / timeout'''
+    if _http_status(exc) in RETRYABLE_STATUS or is_rate_limited(exc):
+        return True
+    return is_network_error(exc)
+
+def _retry_after(exc):
+    '''Header Retry-After (giây) nếu server có gửi'''
+    resp = getattr(exc, 'resp', None)
+    try:
+        return float(resp.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    '''
+    Giới hạn tốc độ chung cho cả process: `rate` token / giây, tối đa `capacity` token.
+    acquire(n) chờ tới khi đủ token (n > capacity thì chờ đầy rồi nợ phần dư).
+    '''
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, n=1):
+        '''Lấy n token, trả về số giây đã phải chờ'''
+        if self.rate <= 0:
+            return 0.0
+        needed = min(n, self.capacity)
+        waited = 0.0
+        with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= n
+                    return waited
+                delay = (needed - self._tokens) / self.rate
+                time.sleep(delay)   # Giữ lock → các thread khác xếp hàng theo thứ tự
+                waited += delay
+
+class DriveRequestExecutor:
+    '''
+    Điểm chung cho mọi request Drive:
+    - qua token bucket trước khi gửi (giới hạn theo quota của project)
+    - lỗi tạm thời (429, rateLimitExceeded, 5xx, mất kết nối) → thử lại
+      exponential backoff + jitter (tôn trọng Retry-After nếu có)
+    - thống kê: số request, số lần thử lại, thời gian chờ, throughput
+    '''
+
+    def __init__(self, rate=DRIVE_REQUESTS_PER_SECOND, burst=DRIVE_REQUESTS_BURST,
+                 max_retries=DRIVE_MAX_RETRIES, backoff_base=DRIVE_BACKOFF_BASE,
+                 backoff_max=DRIVE_BACKOFF_MAX):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+        self.throttle_wait = 0.0   # giây chờ token bucket
+        self.backoff_wait = 0.0    # giây chờ trước khi thử lại
+        self._started = None
+
+    def _count(self, **deltas):
+        with self._lock:
+            if self._started is None:
+                self._started = time.time()
+            for name, value in deltas.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def backoff(self, attempt, exc=None):
+        '''Ngủ trước lần thử lại thứ attempt (full jitter), trả về số giây đã ngủ'''
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = _retry_after(exc) if exc is not None else None
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        time.sleep(delay)
+        self._count(retries=1, backoff_wait=delay)
+        return delay
+
+    def call(self, func, cost=1):
+        '''Gọi func() (1 request HTTP, cost = số request tính vào quota), thử lại khi lỗi tạm thời'''
+        attempt = 0
+        while True:
+            waited = self.bucket.acquire(cost)
+            self._count(requests=cost, throttle_wait=waited)
+            try:
+                return func()
+            except Exception as e:
+                if is_rate_limited(e):
+                    self._count(rate_limited=1)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    self._count(failures=1)
+                    raise
+                self.backoff(attempt, e)
+                attempt += 1
+
+    def execute(self, request):
+        '''request.execute() có thử lại'''
+        return self.call(request.execute)
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.time() - self._started if self._started else 0.0
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'failures': self.failures,
+                'throttle_wait': self.throttle_wait,
+                'backoff_wait': self.backoff_wait,
+                'requests_per_second': self.requests / elapsed if elapsed > 0 else 0.0
+            }
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_request_executor():
+    '''Executor dùng chung cho mọi Drive call trong process'''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = DriveRequestExecutor()
+        return _executor
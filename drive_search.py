@@ -0,0 +1,50 @@
+import re
+import unicodedata
+
+_COMBINING = re.compile('[\u0300-\u036f]')
+
+def normalize_name(text):
+    '''Chữ thường + bỏ dấu tiếng Việt → "Hóa Đơn" khớp "hoa don"'''
+    text = unicodedata.normalize('NFD', text.casefold().replace('đ', 'd'))
+    return _COMBINING.sub('', text)
+
+class LocalNameSearch:
+    '''
+    Lọc tên file trong danh sách đã tải (không gọi API), dùng cho search-as-you-type:
+    - không phân biệt hoa thường / dấu tiếng Việt
+    - mỗi từ trong query phải có trong tên, không cần đúng thứ tự ("metro 123 don")
+    - gõ thêm ký tự (query mới bắt đầu bằng query cũ) → chỉ lọc lại trong kết quả trước
+    search() trả về list index trong files, giữ nguyên thứ tự ban đầu.
+    '''
+
+    def __init__(self, files):
+        self.files = files
+        # Chuẩn hóa cả khối 1 lần (nhanh hơn từng tên)
+        corpus = normalize_name('\n'.join(f['name'].replace('\n', ' ') for f in files))
+        self._names = corpus.split('\n') if files else []
+
+        self._last_query = None
+        self._last_matches = None
+
+    def search(self, query):
+        query = normalize_name(query.strip())
+        words = query.split()
+        if not words:
+            self._last_query = None
+            return list(range(len(self.files)))
+
+        # Query dài thêm → tập kết quả chỉ có thể nhỏ đi
+        if self._last_query is not None and query.startswith(self._last_query):
+            candidates = self._last_matches
+        else:
+            candidates = range(len(self._names))
+
+        names = self._names
+        matches = candidates
+        # Từ dài nhất trước → loại được nhiều nhất ở vòng đầu
+        for word in sorted(words, key=len, reverse=True):
+            matches = [i for i in matches if word in names[i]]
+
+        self._last_query = query
+        self._last_matches = matches
+        return matches
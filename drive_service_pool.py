@@ -0,0 +1,70 @@
+import threading
+
+class DriveServicePool:
+    '''
+    Pool Drive client dùng chung 1 bộ credentials:
+    - mỗi thread 1 client riêng (httplib2.Http không dùng chung được giữa các thread)
+    - client giữ kết nối HTTP mở → các request liên tiếp trong cùng thread dùng lại kết nối
+    - thread kết thúc → client được thu hồi, thread mới dùng lại thay vì build lại
+    - giữ tối đa `size` client rảnh, client dư bị bỏ
+    '''
+
+    def __init__(self, build_func, size):
+        self.build_func = build_func    # () -> Drive service mới
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._owners = {}   # thread -> service đang dùng
+        self._idle = []     # service rảnh (của thread đã kết thúc / đã trả)
+
+        self.created = 0
+        self.reused = 0
+
+    def _reclaim(self):
+        '''Thu hồi client của các thread đã kết thúc (gọi khi đang giữ lock)'''
+        for thread in [t for t in self._owners if not t.is_alive()]:
+            service = self._owners.pop(thread)
+            if len(self._idle) < self.size:
+                self._idle.append(service)
+
+    def get(self):
+        '''Client của thread hiện tại (tạo mới / lấy client rảnh nếu chưa có)'''
+        thread = threading.current_thread()
+        with self._lock:
+            service = self._owners.get(thread)
+            if service is not None:
+                return service
+            self._reclaim()
+            if self._idle:
+                service = self._idle.pop()
+                self._owners[thread] = service
+                self.reused += 1
+                return service
+
+        # Build ngoài lock (tốn vài trăm ms) → các thread khác không phải chờ
+        service = self.build_func()
+        with self._lock:
+            self._owners[thread] = service
+            self.created += 1
+        return service
+
+    def release(self):
+        '''Trả client của thread hiện tại về pool (thread sắp không dùng Drive nữa)'''
+        with self._lock:
+            service = self._owners.pop(threading.current_thread(), None)
+            if service is not None and len(self._idle) < self.size:
+                self._idle.append(service)
+
+    def clear(self):
+        '''Bỏ toàn bộ client (VD: sau khi đổi credentials)'''
+        with self._lock:
+            self._owners.clear()
+            self._idle.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': len(self._owners),
+                'idle': len(self._idle),
+                'created': self.created,
+                'reused': self.reused
+            }
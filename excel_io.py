@@ -0,0 +1,367 @@
+import os
+import time
+from itertools import islice
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment
+
+from config import (
+    EXCEL_CHECKPOINT_FILES, EXCEL_CHECKPOINT_SECONDS,
+    EXCEL_SHARD_MAX_ROWS, EXCEL_SHARD_MAX_BYTES
+)
+from dedup_index import DedupIndex
+from excel_shards import ShardManifest
+
+class SheetLayout:
+    '''
+    Bố cục 1 sheet output: tên sheet, header, màu header, độ rộng cột, định dạng số.
+    Dùng chung cho file gốc (init_excel) và các shard mới (tạo ở chế độ write-only).
+    '''
+
+    def __init__(self, title, headers, header_color, column_widths, number_formats=None):
+        self.title = title
+        self.headers = headers
+        self.header_color = header_color
+        self.column_widths = column_widths    # {'A': 18, ...}
+        self.number_formats = number_formats  # row -> {index cột: number_format}
+
+    def create(self, path, rows=()):
+        '''Tạo workbook mới ở chế độ write-only (header + rows có sẵn)'''
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet(self.title)
+
+        for col, width in self.column_widths.items():
+            ws.column_dimensions[col].width = width
+        ws.freeze_panes = 'A2'
+
+        header_font = Font(bold=True, color="FFFFFF", size=11)
+        header_fill = PatternFill(start_color=self.header_color, end_color=self.header_color, fill_type="solid")
+        header_alignment = Alignment(horizontal="center", vertical="center")
+
+        header_cells = []
+        for title in self.headers:
+            cell = WriteOnlyCell(ws, value=title)
+            cell.font = header_font
+            cell.fill = header_fill
+            cell.alignment = header_alignment
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        for r in rows:
+            ws.append(self._write_only_row(ws, r))
+
+        wb.save(path)
+
+    def _write_only_row(self, ws, r):
+        formats = self.number_formats(r) if self.number_formats else None
+        if not formats:
+            return list(r)
+        cells = []
+        for i, value in enumerate(r):
+            if i in formats:
+                cell = WriteOnlyCell(ws, value=value)
+                cell.number_format = formats[i]
+                cells.append(cell)
+            else:
+                cells.append(value)
+        return cells
+
+    def format_row(self, ws, row_idx, r):
+        '''Định dạng số cho dòng vừa append (workbook thường)'''
+        if not self.number_formats:
+            return
+        for i, fmt in self.number_formats(r).items():
+            ws.cell(row=row_idx, column=i + 1).number_format = fmt
+
+class WorkbookWriter:
+    '''
+    Phiên ghi Excel cho cả batch:
+    - load workbook 1 lần, chống trùng qua index lưu cạnh workbook (.keys)
+    - lưu theo checkpoint (mỗi N file hoặc T giây, gọi checkpoint() sau append_rows) và khi đóng
+    - on_save: callback() sau mỗi lần lưu thành công (dữ liệu đã nằm trên đĩa)
+    - mirror: bản ghi phụ (VD: ParquetSink) nhận rows đã thêm, commit mỗi lần workbook lưu xong
+    - chỉ ghi vào shard đang active; vượt ngưỡng dòng / dung lượng → tạo shard mới
+    - thống kê số lần lưu và số byte đã ghi
+    '''
+
+    def __init__(self, excel_file, init_func, key_func, layout=None,
+                 checkpoint_files=EXCEL_CHECKPOINT_FILES,
+                 checkpoint_seconds=EXCEL_CHECKPOINT_SECONDS,
+                 max_rows=EXCEL_SHARD_MAX_ROWS,
+                 max_bytes=EXCEL_SHARD_MAX_BYTES):
+        self.excel_file = excel_file
+        self.init_func = init_func            # Tạo file + header nếu chưa có
+        self.key_func = key_func              # row -> key chống trùng (None = không check)
+        self.layout = layout                  # SheetLayout (None = không định dạng, không tách shard)
+        self.checkpoint_files = checkpoint_files
+        self.checkpoint_seconds = checkpoint_seconds
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+        self.manifest = ShardManifest(excel_file)
+        self.active_file = self.manifest.active_path()
+
+        self.wb = None
+        self.ws = None
+        self.index = DedupIndex(
+            excel_file + ".keys",
+            self.manifest.paths,
+            self._iter_existing_keys
+        )
+        self.shards_created = 0
+        self._active_rows = 0
+        self.saves = 0
+        self.bytes_written = 0
+        self.rows_added = 0
+        self.rows_skipped = 0
+        self._pending_files = 0
+        self._next_checkpoint = checkpoint_files
+        self._last_save = time.time()
+        self.on_save = None
+        self.mirror = None
+
+    def open(self):
+        '''Load workbook + key đã có (1 lần cho cả batch)'''
+        if self.wb is not None:
+            return self
+
+        if not os.path.exists(self.excel_file):
+            self.init_func()
+
+        self.manifest.load()
+        self.active_file = self.manifest.active_path()
+        if not os.path.exists(self.active_file) and self.layout:
+            self.layout.create(self.active_file)
+
+        # Index hợp lệ → không cần quét lại các dòng cũ
+        self.index.load()
+
+        # Shard active đã đầy → mở shard mới, không load file lớn
+        if self._is_full(self.active_file):
+            self._add_shard()
+            self.index.commit()
+
+        self.wb = load_workbook(self.active_file)
+        self.ws = self.wb.active
+        self._active_rows = max(0, self.ws.max_row - 1)
+
+        self._last_save = time.time()
+        return self
+
+    def _iter_existing_keys(self):
+        '''Quét mọi shard để build lại index (chỉ khi index thiếu / cũ)'''
+        for row in iter_workbook_rows(self.manifest.paths()):
+            yield self.key_func(row)
+
+    def _is_full(self, path):
+        '''Shard đã vượt ngưỡng dòng / dung lượng (đọc nhanh, không load toàn bộ)'''
+        if not self.layout or not os.path.exists(path):
+            return False
+        try:
+            if self.max_bytes and os.path.getsize(path) >= self.max_bytes:
+                return True
+            if self.max_rows:
+                wb = load_workbook(path, read_only=True)
+                try:
+                    return (wb.active.max_row or 1) - 1 >= self.max_rows
+                finally:
+                    wb.close()
+        except Exception as e:
+            print(f"Không đọc được kích thước shard {path}: {e}")
+        return False
+
+    def _needs_rotation(self, new_rows):
+        if not self.layout or not self._active_rows:
+            return False
+        if self.max_rows and self._active_rows + new_rows > self.max_rows:
+            return True
+        if self.max_bytes:
+            try:
+                return os.path.getsize(self.active_file) >= self.max_bytes
+            except OSError:
+                pass
+        return False
+
+    def _add_shard(self, rows=()):
+        '''Tạo shard mới (write-only) chứa sẵn rows và chuyển sang ghi vào shard đó'''
+        path = self.manifest.next_shard_path()
+        self.layout.create(path, rows)
+        self.manifest.add_shard(path)
+        self.active_file = path
+        self.shards_created += 1
+        print(f"📂 Tạo shard mới: {os.path.basename(path)}")
+        return path
+
+    def _rotate(self, rows):
+        '''Chốt shard hiện tại, ghi rows sang shard mới'''
+        self.wb.save(self.active_file)
+        self.wb.close()
+
+        self._add_shard(rows)
+        self.wb = load_workbook(self.active_file)
+        self.ws = self.wb.active
+        self._active_rows = len(rows)
+
+        self.index.commit()
+        self.saves += 1
+        try:
+            self.bytes_written += os.path.getsize(self.active_file)
+        except OSError:
+            pass
+        if self.on_save:
+            self.on_save()
+
+    def append_rows(self, rows):
+        '''Thêm rows của 1 file PDF, trả về (rows đã thêm, số dòng trùng bị bỏ)'''
+        self.open()
+
+        accepted = []
+        skipped = 0
+        for r in rows:
+            key = self.key_func(r)
+            if key and not self.index.add(key):
+                skipped += 1
+                continue
+            accepted.append(r)
+
+        added = len(accepted)
+        first_row = self.ws.max_row + 1
+        rotated = False
+        try:
+            if accepted and self._needs_rotation(added):
+                self._rotate(accepted)
+                rotated = True
+            else:
+                for r in accepted:
+                    self.ws.append(r)
+                    if self.layout:
+                        self.layout.format_row(self.ws, self.ws.max_row, r)
+                self._active_rows += added
+        except Exception:
+            # Rows không vào được workbook → gỡ phần đã ghi + key, file được xử lý lại sau
+            if self.ws is not None and self.ws.max_row >= first_row:
+                self.ws.delete_rows(first_row, self.ws.max_row - first_row + 1)
+            for r in accepted:
+                self.index.discard(self.key_func(r))
+            raise
+
+        self.rows_added += added
+        self.rows_skipped += skipped
+        self._pending_files += 1
+
+        if self.mirror is not None and accepted:
+            self._mirror_call(self.mirror.append_rows, accepted)
+            # Shard mới đã chứa sẵn rows này trên đĩa → publish luôn
+            if rotated:
+                self._mirror_call(self.mirror.commit)
+        return accepted, skipped
+
+    def _mirror_call(self, func, *args):
+        '''Bản ghi phụ lỗi không làm hỏng workbook'''
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"⚠️ Lỗi ghi bản phụ ({type(self.mirror).__name__}): {e}")
+
+    def checkpoint(self):
+        '''
+        Lưu nếu đã đủ N file / T giây kể từ lần lưu trước, trả về True nếu đã lưu.
+        Lỗi lưu (VD: file đang mở trong Excel) là lỗi của writer, không phải của file vừa thêm:
+        rows vẫn nằm trong workbook, thử lại sau N file / T giây nữa (không thử lại từng file).
+        '''
+        due = self._pending_files >= self._next_checkpoint or (
+            self._pending_files and time.time() - self._last_save >= self.checkpoint_seconds
+        )
+        if not due:
+            return False
+        try:
+            self.save()
+        except Exception:
+            self._next_checkpoint = self._pending_files + self.checkpoint_files
+            self._last_save = time.time()
+            raise
+        return True
+
+    def save(self):
+        '''Lưu workbook xuống đĩa'''
+        if self.wb is None:
+            return
+        self.wb.save(self.active_file)
+        self.index.commit()
+        self.saves += 1
+        try:
+            self.bytes_written += os.path.getsize(self.active_file)
+        except OSError:
+            pass
+        self._pending_files = 0
+        self._next_checkpoint = self.checkpoint_files
+        self._last_save = time.time()
+        if self.mirror is not None:
+            self._mirror_call(self.mirror.commit)
+        if self.on_save:
+            self.on_save()
+
+    def close(self):
+        '''Lưu lần cuối (nếu còn thay đổi) và đóng workbook'''
+        if self.wb is None:
+            return
+        try:
+            if self._pending_files:
+                self.save()
+        finally:
+            self.wb.close()
+            self.wb = None
+            self.ws = None
+            # Rows chưa lưu được vào workbook thì cũng không publish
+            if self.mirror is not None:
+                self._mirror_call(self.mirror.close)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def stats(self):
+        return {
+            'rows_added': self.rows_added,
+            'rows_skipped': self.rows_skipped,
+            'saves': self.saves,
+            'bytes_written': self.bytes_written,
+            'shards': len(self.manifest.shards),
+            'shards_created': self.shards_created
+        }
+
+def _iter_file_rows(excel_file, max_col):
+    wb = load_workbook(excel_file, read_only=True)
+    try:
+        for row in wb.active.iter_rows(min_row=2, max_col=max_col, values_only=True):
+            if row and row[0]:
+                yield row
+    finally:
+        wb.close()
+
+def iter_workbook_rows(excel_files, columns=None, start=0, stop=None):
+    '''
+    Đọc dữ liệu dạng streaming (openpyxl read_only) - bộ nhớ không tăng theo kích thước file
+    - excel_files: 1 đường dẫn hoặc list các shard (đọc nối tiếp theo thứ tự)
+    - columns: list index cột cần lấy (None = tất cả cột)
+    - start / stop: khoảng dòng dữ liệu [start, stop) tính trên toàn bộ các shard
+    Bỏ qua dòng trống (cột ThoiGianThucThi rỗng)
+    '''
+    if isinstance(excel_files, (str, bytes, os.PathLike)):
+        excel_files = [excel_files]
+
+    max_col = max(columns) + 1 if columns else None
+
+    def rows():
+        for excel_file in excel_files:
+            yield from _iter_file_rows(excel_file, max_col)
+
+    for row in islice(rows(), start, stop):
+        if columns:
+            yield tuple(row[i] if i < len(row) else None for i in columns)
+        else:
+            yield row
@@ -0,0 +1,83 @@
+import os
+import json
+
+class ShardManifest:
+    '''
+    Danh sách shard của 1 file output (VD: output_format2.shards.json)
+    - Shard 0 luôn là file gốc (output.xlsx / output_format2.xlsx)
+    - Shard mới: output_format2.0001.xlsx, output_format2.0002.xlsx, ...
+    - Shard cuối cùng là shard đang ghi (active)
+    '''
+
+    def __init__(self, base_file):
+        self.base_file = base_file
+        self.directory = os.path.dirname(os.path.abspath(base_file))
+        self.stem, self.ext = os.path.splitext(os.path.basename(base_file))
+        self.manifest_path = os.path.join(self.directory, f"{self.stem}.shards.json")
+        self.shards = [os.path.basename(base_file)]
+        self.load()
+
+    def load(self):
+        '''Đọc manifest (không có → chỉ có file gốc)'''
+        self.shards = [os.path.basename(self.base_file)]
+        if not os.path.exists(self.manifest_path):
+            return self
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            shards = [s["file"] for s in data.get("shards", []) if s.get("file")]
+            if shards:
+                self.shards = shards
+        except Exception as e:
+            print(f"Lỗi đọc manifest {self.manifest_path}: {e}")
+        return self
+
+    def save(self):
+        '''Ghi manifest (atomic)'''
+        data = {"version": 1, "shards": [{"file": name} for name in self.shards]}
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def paths(self):
+        '''Đường dẫn tất cả shard đang tồn tại, theo thứ tự'''
+        result = []
+        for name in self.shards:
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                result.append(path)
+        return result
+
+    def active_path(self):
+        return os.path.join(self.directory, self.shards[-1])
+
+    def next_shard_path(self):
+        '''Tên shard kế tiếp: <stem>.0001<ext>, <stem>.0002<ext>, ...'''
+        number = len(self.shards)
+        while True:
+            name = f"{self.stem}.{number:04d}{self.ext}"
+            path = os.path.join(self.directory, name)
+            if name not in self.shards and not os.path.exists(path):
+                return path
+            number += 1
+
+    def add_shard(self, path):
+        self.shards.append(os.path.basename(path))
+        self.save()
+
+    def reset(self):
+        '''Xóa mọi shard phụ, chỉ giữ file gốc'''
+        for name in self.shards[1:]:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"Không thể xóa shard {path}: {e}")
+        self.shards = [os.path.basename(self.base_file)]
+        try:
+            if os.path.exists(self.manifest_path):
+                os.remove(self.manifest_path)
+        except OSError as e:
+            print(f"Không thể xóa manifest: {e}")
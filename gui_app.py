@@ -2,20 +2,23 @@ import os
 import threading
 import tempfile
 import shutil
+from collections import deque
 from pathlib import Path
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 
-from config import EXCEL_FILE, GOOGLE_DRIVE_AVAILABLE
-from excel_handler import init_excel, read_excel_data
-from excel_handler_format2 import init_excel_format2, read_excel_data_format2
-from pdf_processor import process_pdf
-from pdf_processor_format2 import process_pdf_format2
+from config import EXCEL_FILE, GUI_PREVIEW_ROWS, check_google_drive
+from excel_handler import init_excel, iter_excel_data
+from excel_handler_format2 import init_excel_format2, iter_excel_data_format2
+from excel_shards import ShardManifest
+from batch_processor import process_batch, open_writer
+from drive_prefetch import DrivePrefetcher, get_blob_cache
 from drive_manager import GoogleDriveManager
 from dialogs import DriveFilePicker, DriveFolderPicker
 from logger_handler import (
     write_log, write_success, write_error, 
-    read_log_file, clear_log_file, init_log_files, is_file_processed
+    read_log_file, clear_log_file, init_log_files,
+    compute_file_hash, is_hash_processed, mark_file_queued, mark_file_running, export_logs
 )
 
 class LogViewerDialog:
@@ -151,6 +154,7 @@ class PDFExtractorApp:
         
         self.pdf_files = []
         self.drive_files = []
+        self.pending_syncs = []  # (checkpoint, {file_id}) - lưu mốc Changes API khi xử lý xong các file
         self.is_processing = False
         self.drive_manager = GoogleDriveManager()
         self.debug_mode = tk.BooleanVar(value=True)
@@ -573,57 +577,79 @@ class PDFExtractorApp:
             self.log(f"✅ Đã thêm {count} file từ thư mục")
             write_log(f"Added {count} files from folder: {folder}", "info")
     
-    def add_drive_files(self):
-        """Chọn file từ Drive"""
-        if not GOOGLE_DRIVE_AVAILABLE:
+    def ensure_drive_authenticated(self):
+        """Xác thực Drive nếu chưa (không chờ mạng - kiểm tra kết nối chạy nền)"""
+        if not check_google_drive():
             messagebox.showerror("Lỗi", "Chưa cài đặt thư viện Google Drive")
-            return
+            return False
         
         if not self.drive_manager.authenticated:
             self.log("🔐 Đang xác thực Google Drive...")
-            success, message = self.drive_manager.authenticate()
+            success, message = self.drive_manager.authenticate(
+                on_checked=lambda ok, msg: self.log(msg if ok else f"❌ {msg}")
+            )
             if not success:
                 messagebox.showerror("Lỗi", message)
-                return
-            self.log(f"✅ {message}")
+                return False
+            self.log(message)
+        return True
+    
+    def add_drive_files(self):
+        """Chọn file từ Drive"""
+        if not self.ensure_drive_authenticated():
+            return
         
         picker = DriveFilePicker(self.root, self.drive_manager, self.log)
         files = picker.show()
         
         if files:
-            for file_id, file_name in files:
-                self.drive_files.append((file_id, file_name))
-                self.pdf_files.append(f"drive://{file_id}")
-                self.file_listbox.insert(tk.END, f"☁️ {file_name}")
+            count = self._add_drive_entries(files)
             
-            self.log(f"✅ Đã thêm {len(files)} file từ Drive")
-            write_log(f"Added {len(files)} files from Google Drive", "info")
+            self.log(f"✅ Đã thêm {count} file từ Drive")
+            write_log(f"Added {count} files from Google Drive", "info")
+    
+    def _add_drive_entries(self, files):
+        """Thêm file Drive vào danh sách, bỏ file đã có (cùng file chọn 2 lần → tải / xóa chung 1 temp_path)"""
+        existing = set(self.pdf_files)
+        count = 0
+        for file_id, file_name in files:
+            path = f"drive://{file_id}"
+            if path in existing:
+                continue
+            existing.add(path)
+            self.drive_files.append((file_id, file_name))
+            self.pdf_files.append(path)
+            self.file_listbox.insert(tk.END, f"☁️ {file_name}")
+            count += 1
+        return count
     
     def add_drive_folder(self):
         """Chọn folder từ Drive"""
-        if not GOOGLE_DRIVE_AVAILABLE:
-            messagebox.showerror("Lỗi", "Chưa cài đặt thư viện Google Drive")
+        if not self.ensure_drive_authenticated():
             return
         
-        if not self.drive_manager.authenticated:
-            self.log("🔐 Đang xác thực Google Drive...")
-            success, message = self.drive_manager.authenticate()
-            if not success:
-                messagebox.showerror("Lỗi", message)
-                return
-            self.log(f"✅ {message}")
-        
         picker = DriveFolderPicker(self.root, self.drive_manager, self.log)
         files = picker.show()
         
         if files:
-            for file_id, file_name in files:
-                self.drive_files.append((file_id, file_name))
-                self.pdf_files.append(f"drive://{file_id}")
-                self.file_listbox.insert(tk.END, f"☁️ {file_name}")
+            count = self._add_drive_entries(files)
             
-            self.log(f"✅ Đã thêm {len(files)} file từ Drive")
-            write_log(f"Added {len(files)} files from Google Drive folder", "info")
+            self.log(f"✅ Đã thêm {count} file từ Drive")
+            write_log(f"Added {count} files from Google Drive folder", "info")
+            
+            if picker.sync_checkpoint:
+                self.pending_syncs.append((picker.sync_checkpoint, {file_id for file_id, _ in files}))
+    
+    def commit_drive_syncs(self, done_paths):
+        """Lưu mốc đồng bộ Drive khi mọi file của lần sync đó đã xử lý xong (thành công / đã có)"""
+        remaining = []
+        for checkpoint, file_ids in self.pending_syncs:
+            if all(f"drive://{file_id}" in done_paths for file_id in file_ids):
+                self.drive_manager.commit_sync(checkpoint)
+                self.log("🔖 Đã lưu mốc đồng bộ Drive")
+            else:
+                remaining.append((checkpoint, file_ids))
+        self.pending_syncs = remaining
     
     def clear_selected(self):
         """Xóa file đã chọn"""
@@ -655,6 +681,7 @@ class PDFExtractorApp:
             self.file_listbox.delete(0, tk.END)
             self.pdf_files.clear()
             self.drive_files.clear()
+            self.pending_syncs.clear()
             
             self.log(f"🗑️ Đã xóa tất cả {count} file")
             write_log(f"Cleared all {count} files from list", "info")
@@ -677,7 +704,7 @@ class PDFExtractorApp:
                           "Buy", "Net", "QtyCS", "QtyOrdPcs", "QtyRecPcs", "Extended"]
                 col_widths = [65, 100, 90, 80, 120, 115, 60, 60, 75, 75, 60, 70, 70, 85]
                 
-                data = read_excel_data()
+                data = iter_excel_data()
                 
             else:  # format2
                 # Format 2: 19 columns
@@ -688,7 +715,7 @@ class PDFExtractorApp:
                 col_widths = [65, 90, 90, 70, 70, 70, 100, 100, 100, 90, 120,
                              60, 40, 60, 60, 60, 85, 50, 90]
                 
-                data = read_excel_data_format2()
+                data = iter_excel_data_format2()
             
             # Setup columns
             self.output_tree['columns'] = columns
@@ -696,8 +723,15 @@ class PDFExtractorApp:
                 self.output_tree.heading(col_id, text=col_id)
                 self.output_tree.column(col_id, width=width, anchor=tk.W)
             
-            # Insert data
+            # Đọc streaming: đếm tổng số dòng, chỉ giữ N dòng cuối để hiển thị
+            total_rows = 0
+            preview = deque(maxlen=GUI_PREVIEW_ROWS)
             for row in data:
+                total_rows += 1
+                preview.append(row)
+            
+            # Insert data
+            for row in preview:
                 if len(row) >= len(columns):
                     display_row = []
                     for i, val in enumerate(row[:len(columns)]):
@@ -717,7 +751,8 @@ class PDFExtractorApp:
                     
                     self.output_tree.insert("", tk.END, values=display_row)
             
-            self.stats_label.config(text=f"Tổng: {len(data)} dòng | Format: {format_type.upper()}")
+            shown = f" (hiển thị {len(preview)} dòng cuối)" if total_rows > len(preview) else ""
+            self.stats_label.config(text=f"Tổng: {total_rows} dòng{shown} | Format: {format_type.upper()}")
             
         except Exception as e:
             self.log(f"⚠️ Lỗi refresh output: {e}")
@@ -733,6 +768,11 @@ class PDFExtractorApp:
             from excel_handler_format2 import EXCEL_FILE_FORMAT2
             excel_file = EXCEL_FILE_FORMAT2
         
+        # Output đã tách shard → mở shard đang ghi (mới nhất)
+        active_file = ShardManifest(excel_file).active_path()
+        if os.path.exists(active_file):
+            excel_file = active_file
+        
         if os.path.exists(excel_file):
             try:
                 os.startfile(excel_file)
@@ -798,106 +838,229 @@ class PDFExtractorApp:
         thread.start()
 
     def process_files(self):
-        """Xử lý các file"""
+        """Xử lý các file - song song nhiều core qua process_batch"""
         total = len(self.pdf_files)
-        success = 0
-        failed = 0
-        skipped = 0
+        counts = {"success": 0, "failed": 0, "skipped": 0, "done": 0}
         
         format_type = self.current_format.get()
+        debug = self.debug_mode.get()
         
         self.log("\n" + "="*50)
         self.log(f"🚀 Bắt đầu xử lý {total} files - {format_type.upper()}")
-        if self.debug_mode.get():
+        if debug:
             self.log("🐛 DEBUG MODE: ON")
         self.log("="*50 + "\n")
         
         write_log(f"Started processing {total} files - {format_type}", "info")
         
         temp_dir = tempfile.mkdtemp()
-        
-        for i, pdf_path in enumerate(self.pdf_files, 1):
-            filename_for_log = ""
-            
+        jobs = {}  # key job gửi vào batch -> (index, filename_for_log, temp_path, sha256)
+        batch_hashes = set()  # Nội dung trùng nhau trong cùng 1 batch
+        done_paths = set()  # File đã xử lý xong (lưu thành công / đã có từ trước)
+        
+        def update_progress():
+            counts["done"] += 1
+            self.status_label.config(text=f"Đang xử lý {counts['done']}/{total}...")
+            self.progress['value'] = (counts["done"] / total) * 100
+        
+        def record_failure(i, filename_for_log, error_msg, file_hash=None, duration=None):
+            counts["failed"] += 1
+            self.log(f"❌ [{i}/{total}] Lỗi '{filename_for_log}': {error_msg}\n")
+            write_error(filename_for_log, error_msg, file_hash, duration)
+            write_log(f"Failed to process '{filename_for_log}': {error_msg}", "error")
+        
+        def accept_job(i, job_key, source, filename_for_log, temp_path):
+            """Kiểm tra nội dung đã xử lý chưa (SHA-256) - trước khi parse/OCR"""
             try:
-                self.status_label.config(text=f"Đang xử lý {i}/{total}...")
-                self.progress['value'] = (i / total) * 100
-                
-                # Xác định tên file
-                if pdf_path.startswith("drive://"):
-                    file_id = pdf_path.replace("drive://", "")
-                    
-                    file_name = None
-                    for fid, fname in self.drive_files:
-                        if fid == file_id:
-                            file_name = fname
-                            break
-                    
-                    if not file_name:
-                        file_name = f"Unknown_Drive_File_{file_id[:8]}"
-                    
-                    filename_for_log = file_name
-                else:
-                    filename_for_log = os.path.basename(pdf_path)
-                
-                # Kiểm tra đã xử lý chưa
-                if is_file_processed(filename_for_log):
-                    skipped += 1
-                    self.log(f"⏭️ [{i}/{total}] Bỏ qua (đã xử lý): {filename_for_log}\n")
-                    write_log(f"Skipped already processed file: {filename_for_log}", "info")
-                    continue
-                
-                # Xử lý file
-                if pdf_path.startswith("drive://"):
-                    self.log(f"☁️ [{i}/{total}] Đang tải: {filename_for_log}")
-                    
-                    temp_path = os.path.join(temp_dir, filename_for_log)
-                    
-                    download_success = self.drive_manager.download_file(file_id, temp_path)
-                    if not download_success:
-                        raise Exception("Không thể tải file từ Drive")
-                    
-                    # Process theo format
-                    if format_type == "format1":
-                        items = process_pdf(temp_path, self.log, self.debug_mode.get())
-                    else:
-                        items = process_pdf_format2(temp_path, self.log, self.debug_mode.get())
-                    
+                file_hash = compute_file_hash(source)
+            except Exception as e:
+                update_progress()
+                record_failure(i, filename_for_log, f"Không đọc được file: {e}")
+                return False
+            
+            already_done = is_hash_processed(file_hash)
+            if already_done or file_hash in batch_hashes:
+                counts["skipped"] += 1
+                if already_done:
+                    done_paths.add(self.pdf_files[i - 1])
+                update_progress()
+                self.log(f"⏭️ [{i}/{total}] Bỏ qua (đã xử lý): {filename_for_log}\n")
+                write_log(f"Skipped already processed file: {filename_for_log} ({file_hash[:12]})", "info")
+                if temp_path:
                     try:
                         os.remove(temp_path)
                     except:
                         pass
-                else:
+                return False
+            
+            batch_hashes.add(file_hash)
+            jobs[job_key] = (i, filename_for_log, temp_path, file_hash)
+            mark_file_queued(filename_for_log, file_hash)
+            return True
+        
+        def start_job(job_key):
+            """Process con đã nhận file → trạng thái running"""
+            _, filename_for_log, _, file_hash = jobs[job_key]
+            mark_file_running(filename_for_log, file_hash)
+        
+        # File Drive: tải song song trong lúc file khác đang được parse
+        drive_names = dict(self.drive_files)
+        
+        # Metadata (size / md5) lấy lúc bắt đầu batch bằng HTTP batch → md5 luôn mới khi dùng cache
+        # / kiểm tra md5. File không lấy được metadata thì tải thẳng, không dùng cache
+        drive_ids = [p.replace("drive://", "") for p in self.pdf_files if p.startswith("drive://")]
+        fresh_meta = self.drive_manager.get_files_metadata(drive_ids) if drive_ids else {}
+        if drive_ids:
+            self.log(f"ℹ️ Đã lấy metadata {len(fresh_meta)}/{len(drive_ids)} file Drive")
+        
+        drive_items = []
+        for i, pdf_path in enumerate(self.pdf_files, 1):
+            if not pdf_path.startswith("drive://"):
+                continue
+            file_id = pdf_path.replace("drive://", "")
+            file_name = drive_names.get(file_id) or f"Unknown_Drive_File_{file_id[:8]}"
+            # File lớn ghi ra đĩa: mỗi file 1 thư mục con → không đè nhau khi trùng tên
+            temp_path = os.path.join(temp_dir, file_id, file_name)
+            # Size → giới hạn dung lượng đang tải chính xác hơn
+            # md5 không đổi → dùng lại bản đã tải trong cache, không tải lại
+            meta = fresh_meta.get(file_id, {})
+            drive_items.append(((i, file_name), file_id, temp_path, meta.get('size'), meta.get('md5Checksum')))
+        
+        prefetcher = DrivePrefetcher(self.drive_manager, drive_items, blob_cache=get_blob_cache())
+        if drive_items:
+            self.log(f"☁️ Tải song song {len(drive_items)} file Drive ({prefetcher.workers} luồng)")
+        
+        def iter_jobs():
+            """Sinh đường dẫn PDF cho batch (file local trước, file Drive theo thứ tự tải xong)"""
+            if drive_items:
+                prefetcher.start()
+            
+            for i, pdf_path in enumerate(self.pdf_files, 1):
+                if pdf_path.startswith("drive://"):
+                    continue
+                filename_for_log = os.path.basename(pdf_path)
+                if accept_job(i, pdf_path, pdf_path, filename_for_log, None):
                     self.log(f"📄 [{i}/{total}] Đang xử lý: {filename_for_log}")
-                    
-                    if format_type == "format1":
-                        items = process_pdf(pdf_path, self.log, self.debug_mode.get())
-                    else:
-                        items = process_pdf_format2(pdf_path, self.log, self.debug_mode.get())
+                    yield pdf_path
+            
+            if not drive_items:
+                return
+            
+            for download in prefetcher:
+                i, filename_for_log = download["key"]
+                if not download["ok"]:
+                    update_progress()
+                    record_failure(i, filename_for_log, "Không thể tải file từ Drive")
+                    continue
                 
-                # Thành công
-                success += 1
-                self.log(f"✅ [{i}/{total}] Thành công: {items} items\n")
-                write_success(filename_for_log)
+                # File nhỏ nằm trong RAM (bytes), file lớn đã ghi ra temp_dir
+                in_memory = download["data"] is not None
+                source = download["data"] if in_memory else download["path"]
+                where = "RAM" if in_memory else "đĩa"
+                if download["from_cache"]:
+                    where += ", cache"
+                self.log(f"☁️ [{i}/{total}] Đã tải: {filename_for_log} ({download['elapsed']:.1f}s, {where})")
                 
-            except Exception as e:
-                failed += 1
+                # File nằm trong cache → giữ lại, không xóa sau khi xử lý
+                job_key = f"drive://{download['file_id']}"
+                temp_path = None if download["cached"] else download["path"]
+                if accept_job(i, job_key, source, filename_for_log, temp_path):
+                    yield (job_key, source, filename_for_log)
+                else:
+                    prefetcher.release(download["file_id"])
+        
+        # 1 phiên ghi Excel cho cả batch (load 1 lần, lưu theo checkpoint)
+        writer = open_writer(format_type)
+        
+        # Chỉ đánh dấu "đã xử lý" khi dòng đã được lưu xuống đĩa
+        # → crash giữa 2 checkpoint thì lần sau các file này được xử lý lại
+        pending_success = []  # (index, filename_for_log, sha256, elapsed)
+        
+        def flush_success():
+            while pending_success:
+                i, filename_for_log, file_hash, elapsed = pending_success.pop(0)
+                write_success(filename_for_log, file_hash, elapsed)
+                done_paths.add(self.pdf_files[i - 1])
+        
+        writer.on_save = flush_success
+        
+        try:
+            for result in process_batch(iter_jobs(), format_type, debug=debug, writer=writer,
+                                        on_start=start_job):
+                i, filename_for_log, temp_path, file_hash = jobs.pop(result["path"])
+                update_progress()
+                
+                for message in result["logs"]:
+                    self.log(message)
                 
-                if not filename_for_log:
-                    if pdf_path.startswith("drive://"):
-                        filename_for_log = f"Drive_File_{pdf_path[8:16]}"
-                    else:
-                        filename_for_log = os.path.basename(pdf_path) if pdf_path else "Unknown_File"
+                if result["error"]:
+                    record_failure(i, filename_for_log, result["error"], file_hash, result["elapsed"])
+                else:
+                    counts["success"] += 1
+                    self.log(f"✅ [{i}/{total}] Thành công: {result['items']} items\n")
+                    pending_success.append((i, filename_for_log, file_hash, result["elapsed"]))
                 
-                error_msg = str(e)
-                self.log(f"❌ [{i}/{total}] Lỗi '{filename_for_log}': {error_msg}\n")
+                if result.get("save_error"):
+                    self.log(f"⚠️ {result['save_error']}\n")
+                    write_log(f"Excel checkpoint failed: {result['save_error']}", "error")
                 
-                write_error(filename_for_log, error_msg)
-                write_log(f"Failed to process '{filename_for_log}': {error_msg}", "error")
+                if temp_path:
+                    try:
+                        os.remove(temp_path)
+                    except:
+                        pass
+                if result["path"].startswith("drive://"):
+                    prefetcher.release(result["path"].replace("drive://", ""))
+        except Exception as e:
+            self.log(f"❌ Lỗi batch: {e}\n")
+            write_log(f"Batch processing aborted: {e}", "error")
+        finally:
+            prefetcher.close()
+            prefetcher.release()
+            try:
+                writer.close()
+                flush_success()  # File không có dòng mới → không cần lưu
+            except Exception as e:
+                self.log(f"❌ Lỗi lưu Excel: {e}\n")
+                write_log(f"Failed to save Excel: {e}", "error")
+                # Dòng chưa xuống đĩa → file chưa xử lý xong
+                for i, filename_for_log, file_hash, elapsed in pending_success:
+                    counts["success"] -= 1
+                    record_failure(i, filename_for_log, f"Không thể lưu vào Excel: {e}", file_hash, elapsed)
+                pending_success.clear()
+        
+        excel_stats = writer.stats()
+        self.log(
+            f"💾 Excel: +{excel_stats['rows_added']} dòng, {excel_stats['saves']} lần lưu, "
+            f"{excel_stats['bytes_written'] / (1024 * 1024):.1f} MB đã ghi"
+        )
+        if drive_items:
+            drive_stats = prefetcher.stats()
+            self.log(
+                f"☁️ Drive: {drive_stats['files']} file, "
+                f"{drive_stats['bytes'] / (1024 * 1024):.1f} MB, {drive_stats['cache_hits']} lấy từ cache"
+            )
+            api_stats = self.drive_manager.executor.stats()
+            self.log(
+                f"☁️ Drive API: {api_stats['requests']} request ({api_stats['requests_per_second']:.1f}/s), "
+                f"{api_stats['retries']} lần thử lại ({api_stats['rate_limited']} lần quá quota), "
+                f"chờ giới hạn tốc độ {api_stats['throttle_wait']:.1f}s, backoff {api_stats['backoff_wait']:.1f}s"
+            )
+            write_log(f"Drive API stats: {api_stats}", "info")
+        
+        success = counts["success"]
+        failed = counts["failed"]
+        skipped = counts["skipped"]
         
         # Dọn dẹp
         shutil.rmtree(temp_dir, ignore_errors=True)
         
+        # Cập nhật success_log.txt / error_log.txt từ store
+        export_logs()
+        
+        # Đồng bộ Drive chỉ tiến mốc khi các file đã lấy về được xử lý hết
+        self.commit_drive_syncs(done_paths)
+        
         # Kết quả
         self.log("="*50)
         self.log("🎉 HOÀN TẤT")
@@ -1,6 +1,8 @@
 import os
+import hashlib
 from datetime import datetime
 from config import LOG_FILE, SUCCESS_FILE, ERROR_FILE
+from state_store import get_state_store, STATUS_DONE, STATUS_FAILED
 
 def write_log(message, log_type="info"):
     """Ghi log vào file app_log.txt"""
@@ -13,67 +15,79 @@ def write_log(message, log_type="info"):
     except Exception as e:
         print(f"Không thể ghi log: {e}")
 
-def write_success(filename):
-    """Ghi file thành công vào success_log.txt"""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Kiểm tra xem file đã tồn tại trong log chưa
-    if os.path.exists(SUCCESS_FILE):
-        with open(SUCCESS_FILE, 'r', encoding='utf-8') as f:
-            existing_logs = f.read()
-            # Kiểm tra nếu file name đã có trong log (tránh duplicate)
-            if f"] {filename}\n" in existing_logs:
-                return False  # Skip nếu đã tồn tại
-    
-    log_entry = f"[{timestamp}] {filename}\n"
-    
+def write_success(filename, file_hash=None, duration=None):
+    """Ghi nhận file thành công (store SQLite, success_log.txt là bản export)"""
     try:
-        with open(SUCCESS_FILE, 'a', encoding='utf-8') as f:
-            f.write(log_entry)
+        store = get_state_store()
+        
+        # Tránh duplicate: cùng nội dung (hash) hoặc cùng tên khi không có hash
+        if file_hash and store.is_hash_done(file_hash):
+            return False
+        if not file_hash and store.is_filename_done(filename):
+            return False
+        
+        store.mark_done(filename, file_hash, duration)
         return True
     except Exception as e:
         print(f"Không thể ghi success log: {e}")
         return False
 
-def is_file_processed(filename):
-    """Kiểm tra file đã được xử lý thành công chưa"""
-    if not os.path.exists(SUCCESS_FILE):
-        return False
+def compute_file_hash(file_path, chunk_size=1024 * 1024):
+    """Tính SHA-256 của file theo từng chunk (không đọc cả file vào RAM) - nhận cả bytes"""
+    if isinstance(file_path, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(file_path).hexdigest()
     
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def is_hash_processed(file_hash):
+    """Kiểm tra nội dung file (SHA-256) đã xử lý thành công chưa - tra index"""
     try:
-        with open(SUCCESS_FILE, 'r', encoding='utf-8') as f:
-            existing_logs = f.read()
-            return f"] {filename}\n" in existing_logs
+        return get_state_store().is_hash_done(file_hash)
     except:
         return False
 
-def write_error(filename, error_message=None):
+def mark_file_queued(filename, file_hash=None):
+    """File đã vào hàng đợi xử lý"""
+    try:
+        get_state_store().mark_queued(filename, file_hash)
+    except Exception as e:
+        print(f"Không thể ghi trạng thái: {e}")
+
+def mark_file_running(filename, file_hash=None):
+    """File bắt đầu được xử lý (tăng số lần thử)"""
+    try:
+        get_state_store().mark_running(filename, file_hash)
+    except Exception as e:
+        print(f"Không thể ghi trạng thái: {e}")
+
+def write_error(filename, error_message=None, file_hash=None, duration=None):
     """
-    Ghi file lỗi vào error_log.txt
-    Format: [timestamp] filename - error_message
+    Ghi nhận file lỗi (store SQLite, error_log.txt là bản export)
+    Export format: [timestamp] filename - error_message
     """
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    # Kiểm tra xem file đã tồn tại trong log chưa
-    if os.path.exists(ERROR_FILE):
-        with open(ERROR_FILE, 'r', encoding='utf-8') as f:
-            existing_logs = f.read()
-            # Kiểm tra nếu file name đã có trong log (tránh duplicate)
-            if f"] {filename} -" in existing_logs or f"] {filename}\n" in existing_logs:
-                return  # Skip nếu đã tồn tại
-    
-    # GHI TIMESTAMP, FILENAME VÀ ERROR MESSAGE
-    if error_message:
-        log_entry = f"[{timestamp}] {filename} - {error_message}\n"
-    else:
-        log_entry = f"[{timestamp}] {filename} - Lỗi không xác định\n"
-    
     try:
-        with open(ERROR_FILE, 'a', encoding='utf-8') as f:
-            f.write(log_entry)
+        get_state_store().mark_failed(filename, error_message, file_hash, duration)
     except Exception as e:
         print(f"Không thể ghi error log: {e}")
 
+def export_logs():
+    """Sinh lại success_log.txt và error_log.txt từ store"""
+    try:
+        store = get_state_store()
+        store.export_log(STATUS_DONE, SUCCESS_FILE)
+        store.export_log(STATUS_FAILED, ERROR_FILE)
+        return True
+    except Exception as e:
+        print(f"Không thể export log: {e}")
+        return False
+
 def read_log_file(log_type="app"):
     """Đọc nội dung file log"""
     log_files = {
@@ -84,6 +98,14 @@ def read_log_file(log_type="app"):
     
     file_path = log_files.get(log_type, LOG_FILE)
     
+    # success/error log được sinh từ store → export trước khi đọc
+    if log_type in ("success", "error"):
+        status = STATUS_DONE if log_type == "success" else STATUS_FAILED
+        try:
+            get_state_store().export_log(status, file_path)
+        except Exception as e:
+            print(f"Không thể export log: {e}")
+    
     if not os.path.exists(file_path):
         return f"File log chưa tồn tại: {os.path.basename(file_path)}"
     
@@ -107,6 +129,12 @@ def clear_log_file(log_type="app"):
     file_path = log_files.get(log_type, LOG_FILE)
     
     try:
+        # Xóa success log = cho phép xử lý lại → xóa trạng thái trong store
+        if log_type == "success":
+            get_state_store().clear_status(STATUS_DONE)
+        elif log_type == "error":
+            get_state_store().clear_status(STATUS_FAILED)
+        
         with open(file_path, 'w', encoding='utf-8') as f:
             f.write("")
         return True
@@ -123,30 +151,23 @@ def init_log_files():
                     f.write(f"# Log file created at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             except Exception as e:
                 print(f"Không thể tạo file log: {e}")
+    
+    # Lần đầu dùng store: import lịch sử từ các file log cũ
+    try:
+        get_state_store().import_legacy(SUCCESS_FILE, ERROR_FILE)
+    except Exception as e:
+        print(f"Không thể import log cũ: {e}")
 
 def get_error_count():
-    """Đếm số file bị lỗi"""
-    if not os.path.exists(ERROR_FILE):
-        return 0
-    
+    """Đếm số file bị lỗi (count theo index)"""
     try:
-        with open(ERROR_FILE, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            # Đếm các dòng có format [timestamp] filename
-            count = sum(1 for line in lines if line.strip() and line.startswith('['))
-            return count
+        return get_state_store().count_status(STATUS_FAILED)
     except:
         return 0
 
 def get_success_count():
-    """Đếm số file thành công"""
-    if not os.path.exists(SUCCESS_FILE):
-        return 0
-    
+    """Đếm số file thành công (count theo index)"""
     try:
-        with open(SUCCESS_FILE, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            count = sum(1 for line in lines if line.strip() and line.startswith('['))
-            return count
+        return get_state_store().count_status(STATUS_DONE)
     except:
-        return 0
\ No newline at end of file
+        return 0
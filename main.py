@@ -1,6 +1,7 @@
 """
 Optimized main.py - Faster startup with lazy imports
 """
+import multiprocessing
 import tkinter as tk
 
 def main():
@@ -12,4 +13,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    # Bắt buộc cho ProcessPool khi đóng gói bằng PyInstaller (Windows)
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
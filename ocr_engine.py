@@ -0,0 +1,320 @@
+import os
+import re
+import time
+import hashlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import (
+    OCR_DPI, OCR_LANG, OCR_MIN_PAGE_CHARS, OCR_WORKERS, OCR_TESSERACT_CONFIG,
+    OCR_MIN_IMAGE_COVERAGE, OCR_MAX_GARBAGE_RATIO, init_tesseract,
+    OCR_CACHE_DIR, OCR_CACHE_MAX_BYTES
+)
+from disk_cache import DiskLRUCache
+from pdf_session import use_session
+
+_tesseract_ready = False
+_ocr_workers = OCR_WORKERS
+_ocr_cache = None
+
+def set_ocr_workers(workers):
+    '''Đổi số tesseract chạy song song (VD: process con của batch dùng ít hơn)'''
+    global _ocr_workers
+    _ocr_workers = max(1, int(workers))
+
+def get_ocr_workers():
+    return _ocr_workers
+
+def get_ocr_cache():
+    '''Cache OCR dùng chung (None nếu tắt)'''
+    global _ocr_cache
+    if _ocr_cache is None and OCR_CACHE_MAX_BYTES > 0:
+        _ocr_cache = DiskLRUCache(OCR_CACHE_DIR, OCR_CACHE_MAX_BYTES, suffix=".txt")
+    return _ocr_cache
+
+def _ensure_tesseract():
+    '''Lazy init Tesseract - chỉ gọi khi thật sự có trang cần OCR'''
+    global _tesseract_ready
+    if not _tesseract_ready:
+        init_tesseract()
+        _tesseract_ready = True
+
+def image_coverage(page):
+    '''Tỉ lệ diện tích ảnh trên trang (0 → 1)'''
+    page_area = float(page.width) * float(page.height)
+    if page_area <= 0:
+        return 0.0
+
+    covered = 0.0
+    for img in page.images:
+        # Cắt theo khung trang (ảnh có thể tràn lề)
+        x0 = max(float(img["x0"]), 0.0)
+        x1 = min(float(img["x1"]), float(page.width))
+        top = max(float(img["top"]), 0.0)
+        bottom = min(float(img["bottom"]), float(page.height))
+        if x1 > x0 and bottom > top:
+            covered += (x1 - x0) * (bottom - top)
+
+    return min(covered / page_area, 1.0)
+
+def garbage_ratio(text):
+    '''
+    Tỉ lệ ký tự rác trong text layer:
+    - (cid:123) do font không có bảng mã Unicode
+    - ký tự thay thế U+FFFD, ký tự điều khiển, private use
+    '''
+    if not text:
+        return 0.0
+
+    cid_chars = sum(len(m) for m in re.findall(r'\(cid:\d+\)', text))
+    rest = re.sub(r'\(cid:\d+\)', '', text)
+
+    bad = 0
+    total = cid_chars
+    for ch in rest:
+        if ch.isspace():
+            continue
+        total += 1
+        code = ord(ch)
+        if ch == '\ufffd' or code < 32 or 0xE000 <= code <= 0xF8FF:
+            bad += 1
+
+    if total == 0:
+        return 0.0
+    return (cid_chars + bad) / total
+
+def needs_ocr(page, text):
+    '''
+    Phân loại 1 trang:
+    - Text layer hỏng (nhiều ký tự rác) → OCR
+    - Đủ chữ → dùng text layer
+    - Ít chữ + ảnh phủ phần lớn trang (trang scan) → OCR
+    - Ít chữ, không có ảnh lớn (trang ngắn / trang trắng) → không OCR
+    '''
+    stripped = text.strip()
+
+    if stripped and garbage_ratio(stripped) >= OCR_MAX_GARBAGE_RATIO:
+        return True
+
+    if len(page.chars) >= OCR_MIN_PAGE_CHARS and len(stripped) >= OCR_MIN_PAGE_CHARS:
+        return False
+
+    return image_coverage(page) >= OCR_MIN_IMAGE_COVERAGE
+
+def _hash_stream(h, obj, seen, depth=0):
+    '''Hash dữ liệu 1 stream (ảnh, form XObject) và các resource lồng bên trong'''
+    from pdfminer.pdftypes import PDFStream, resolve1
+
+    objid = getattr(obj, "objid", None)
+    stream = resolve1(obj)
+    if not isinstance(stream, PDFStream) or depth > 5:
+        return
+    if objid is not None:
+        if objid in seen:
+            return
+        seen.add(objid)
+
+    # Luôn dùng dữ liệu đã decode: pdfminer bỏ rawdata sau khi decode,
+    # dùng get_data() để key ổn định giữa các lần chạy
+    h.update(stream.get_data() or b"")
+
+    resources = resolve1(stream.attrs.get("Resources"))
+    if isinstance(resources, dict):
+        _hash_resources(h, resources, seen, depth + 1)
+
+def _hash_resources(h, resources, seen, depth=0):
+    from pdfminer.pdftypes import resolve1
+
+    xobjects = resolve1(resources.get("XObject"))
+    if not isinstance(xobjects, dict):
+        return
+    for name in sorted(xobjects, key=str):
+        h.update(str(name).encode("utf-8"))
+        _hash_stream(h, xobjects[name], seen, depth)
+
+def page_content_hash(page):
+    '''
+    Hash nội dung 1 trang: content stream + ảnh/form XObject được tham chiếu.
+    (Trang scan thường có content stream giống hệt nhau, chỉ khác ảnh.)
+    '''
+    from pdfminer.pdftypes import resolve1
+
+    h = hashlib.sha256()
+    h.update(f"{page.width}x{page.height}r{getattr(page, 'rotation', 0)}".encode())
+
+    page_obj = page.page_obj
+    seen = set()
+    for content in page_obj.contents or []:
+        _hash_stream(h, content, seen)
+
+    resources = resolve1(page_obj.resources)
+    if isinstance(resources, dict):
+        _hash_resources(h, resources, seen)
+
+    return h.hexdigest()
+
+def ocr_cache_key(page, dpi=OCR_DPI, lang=OCR_LANG, config=OCR_TESSERACT_CONFIG):
+    '''Key cache OCR = hash nội dung trang + DPI + ngôn ngữ + tham số tesseract'''
+    try:
+        content_hash = page_content_hash(page)
+    except Exception as e:
+        print(f"Không hash được trang: {e}")
+        return None
+    raw = f"{content_hash}|{dpi}|{lang}|{config}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def render_page(page, dpi=OCR_DPI):
+    '''Render 1 trang thành ảnh (phải chạy ở thread đang giữ PDF)'''
+    return page.to_image(resolution=dpi).original
+
+def ocr_image(img, lang=OCR_LANG, config=OCR_TESSERACT_CONFIG):
+    '''OCR 1 ảnh bằng tesseract (an toàn khi gọi song song - mỗi lần là 1 process)'''
+    import pytesseract
+    _ensure_tesseract()
+    return pytesseract.image_to_string(img, lang=lang, config=config)
+
+def ocr_page(page, dpi=OCR_DPI, lang=OCR_LANG):
+    '''Render 1 trang và OCR bằng tesseract'''
+    return ocr_image(render_page(page, dpi), lang)
+
+@contextmanager
+def tesseract_thread_limit(workers):
+    '''
+    Khi chạy nhiều tesseract cùng lúc, mỗi process chỉ dùng 1 thread OpenMP
+    để không tranh CPU. Giữ nguyên nếu người dùng đã tự đặt OMP_THREAD_LIMIT.
+    '''
+    if workers <= 1 or "OMP_THREAD_LIMIT" in os.environ:
+        yield
+        return
+
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    try:
+        yield
+    finally:
+        os.environ.pop("OMP_THREAD_LIMIT", None)
+
+def _timed_ocr(img, lang):
+    started = time.time()
+    text = ocr_image(img, lang)
+    return text, time.time() - started
+
+def ocr_pages(session, page_nums, workers=None, dpi=OCR_DPI, lang=OCR_LANG, log_callback=None):
+    '''
+    OCR nhiều trang song song bằng pool tesseract.
+    - Tra cache OCR trước khi render (trang đã OCR → không render lại)
+    - Render tuần tự ở thread hiện tại (pdfplumber không thread-safe)
+    - Tối đa workers * 2 ảnh đang chờ → bộ nhớ có giới hạn
+    Trả về {page_num: text} và {page_num: {"render": s, "ocr": s, "cached": bool}}
+    '''
+    workers = workers or _ocr_workers
+    cache = get_ocr_cache()
+    results = {}
+    timings = {}
+    cache_keys = {}
+
+    def log(msg):
+        if log_callback:
+            log_callback(msg)
+
+    def collect(future, page_num):
+        try:
+            text, ocr_seconds = future.result()
+            results[page_num] = text
+            timings[page_num]["ocr"] = ocr_seconds
+            if cache is not None and cache_keys.get(page_num):
+                cache.put(cache_keys[page_num], text.encode("utf-8"))
+            log(f"  🔎 OCR trang {page_num + 1}: render {timings[page_num]['render']:.2f}s, tesseract {ocr_seconds:.2f}s")
+        except Exception as e:
+            print(f"Lỗi OCR trang {page_num + 1}: {e}")
+
+    with tesseract_thread_limit(workers), ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+
+        for page_num in page_nums:
+            # Backpressure: chờ bớt ảnh trước khi render thêm
+            while len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, pending.pop(future))
+
+            try:
+                page = session.get_page(page_num)
+
+                if cache is not None:
+                    key = ocr_cache_key(page, dpi, lang)
+                    cached = cache.get(key) if key else None
+                    if cached is not None:
+                        results[page_num] = cached.decode("utf-8")
+                        timings[page_num] = {"render": 0.0, "ocr": 0.0, "cached": True}
+                        log(f"  🔎 OCR trang {page_num + 1}: cache hit")
+                        continue
+                    cache_keys[page_num] = key
+
+                started = time.time()
+                img = render_page(page, dpi)
+                timings[page_num] = {"render": time.time() - started, "ocr": 0.0, "cached": False}
+            except Exception as e:
+                print(f"Lỗi render trang {page_num + 1}: {e}")
+                continue
+
+            pending[pool.submit(_timed_ocr, img, lang)] = page_num
+
+        for future in list(pending):
+            collect(future, pending.pop(future))
+
+    return results, timings
+
+def extract_text_with_ocr(pdf_source, log_callback=None):
+    '''
+    Trích xuất text theo từng trang từ 1 lần mở PDF:
+    trang có text layer tốt giữ nguyên, chỉ OCR những trang cần
+    (song song), ghép lại theo đúng thứ tự trang.
+    '''
+    page_texts = []
+
+    try:
+        with use_session(pdf_source) as session:
+            ocr_page_nums = []
+
+            for page_num in range(session.page_count):
+                try:
+                    text = session.get_text(page_num)
+                except:
+                    text = ""
+
+                page_texts.append(text)
+
+                try:
+                    if needs_ocr(session.get_page(page_num), text):
+                        ocr_page_nums.append(page_num)
+                except:
+                    pass
+
+            # Mọi trang gần như trống mà không trang nào được chọn OCR
+            # (scan nhỏ, ảnh ghép nhiều mảnh, ảnh inline) → OCR cả tài liệu như cũ
+            if not ocr_page_nums and page_texts and all(
+                len((text or "").strip()) < OCR_MIN_PAGE_CHARS for text in page_texts
+            ):
+                ocr_page_nums = list(range(len(page_texts)))
+
+            if ocr_page_nums:
+                started = time.time()
+                ocr_results, _ = ocr_pages(session, ocr_page_nums, log_callback=log_callback)
+
+                for page_num, ocr_text in ocr_results.items():
+                    if ocr_text and ocr_text.strip():
+                        page_texts[page_num] = ocr_text
+
+                if log_callback:
+                    log_callback(f"  🔎 OCR {len(ocr_page_nums)} trang trong {time.time() - started:.2f}s")
+                    cache = get_ocr_cache()
+                    if cache is not None:
+                        log_callback(f"  🗄️ OCR cache: {cache.hits} hit / {cache.misses} miss")
+    except Exception as e:
+        print(f"Lỗi đọc PDF: {e}")
+
+    text = ""
+    for page_text in page_texts:
+        if page_text:
+            text += page_text + "\n"
+    return text
@@ -0,0 +1,252 @@
+import os
+import uuid
+from datetime import datetime, date
+
+from config import PARQUET_ENABLED, PARQUET_DIR, PARQUET_ROW_GROUP_ROWS
+
+# Schema theo format: (tên cột, kiểu) - cùng thứ tự với row trong Excel
+# Kiểu: "timestamp" | "string" | "float" | "date"
+COLUMNS_FORMAT1 = [
+    ("processed_at", "timestamp"),
+    ("file_name", "string"),
+    ("po_number", "string"),
+    ("sku_number", "string"),
+    ("description", "string"),
+    ("vendor_part_no", "string"),
+    ("sell_um", "string"),
+    ("buy_um", "string"),
+    ("buy_cost", "float"),
+    ("net_buy_cost", "float"),
+    ("qty_ord_cs", "float"),
+    ("qty_ord_pcs", "float"),
+    ("qty_rec_pcs", "float"),
+    ("extended_cost", "float"),
+]
+
+COLUMNS_FORMAT2 = [
+    ("processed_at", "timestamp"),
+    ("file_name", "string"),
+    ("order_no", "string"),
+    ("order_date", "date"),
+    ("supplier_code", "string"),
+    ("com_contract", "string"),
+    ("ordered_by", "string"),
+    ("delivered_to", "string"),
+    ("for_store", "string"),
+    ("article", "string"),
+    ("article_desc", "string"),
+    ("ou_type", "string"),
+    ("lv", "float"),
+    ("sku_ou", "float"),
+    ("ou_qty", "float"),
+    ("free_qty", "float"),
+    ("net_purchase_price", "float"),
+    ("unit", "string"),
+    ("total_net_purchase_price", "float"),
+]
+
+_DATE_FORMATS = ["%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d.%m.%y", "%d/%m/%y"]
+_TIMESTAMP_FORMAT = "%H:%M:%S %d/%m/%Y"
+
+_pyarrow = None
+
+def _load_pyarrow():
+    '''Lazy import pyarrow - chỉ khi bật xuất Parquet'''
+    global _pyarrow
+    if _pyarrow is None:
+        import pyarrow
+        import pyarrow.parquet
+        _pyarrow = (pyarrow, pyarrow.parquet)
+    return _pyarrow
+
+def is_parquet_available():
+    try:
+        _load_pyarrow()
+        return True
+    except ImportError:
+        return False
+
+def _to_float(value):
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).replace(",", "").strip()
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def _to_date(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def _to_timestamp(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.strptime(str(value).strip(), _TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+def _to_string(value):
+    if value is None:
+        return None
+    return str(value)
+
+_CONVERTERS = {
+    "timestamp": _to_timestamp,
+    "string": _to_string,
+    "float": _to_float,
+    "date": _to_date,
+}
+
+def _arrow_type(pa, kind):
+    return {
+        "timestamp": pa.timestamp("s"),
+        "string": pa.string(),
+        "float": pa.float64(),
+        "date": pa.date32(),
+    }[kind]
+
+class ParquetSink:
+    '''
+    Ghi rows trích xuất ra Parquet (cột có kiểu), song song với Excel:
+    - phân vùng: <PARQUET_DIR>/format=<format>/ingest_date=<YYYY-MM-DD>/part-*.parquet
+    - gom PARQUET_ROW_GROUP_ROWS dòng thành 1 row group
+    - file đang ghi có tên bắt đầu bằng "." → reader bỏ qua
+    - commit() (gọi khi workbook đã lưu) đóng + đổi tên part → chỉ publish rows đã có trong Excel
+    - close() bỏ phần chưa commit (Excel chưa lưu được → lần chạy sau ghi lại)
+    '''
+
+    def __init__(self, format_type, root=PARQUET_DIR, row_group_rows=PARQUET_ROW_GROUP_ROWS):
+        self.format_type = format_type
+        self.columns = COLUMNS_FORMAT1 if format_type == "format1" else COLUMNS_FORMAT2
+        self.root = root
+        self.row_group_rows = max(1, row_group_rows)
+
+        self._buffer = [[] for _ in self.columns]
+        self._buffered = 0
+        self._writer = None
+        self._tmp_path = None
+        self._final_path = None
+        self._part_rows = 0     # rows / row group trong part đang ghi (chưa commit)
+        self._part_groups = 0
+
+        self.rows_written = 0
+        self.row_groups = 0
+        self.files = []
+
+    def append_rows(self, rows):
+        '''Thêm rows của 1 file PDF (đã chống trùng ở WorkbookWriter)'''
+        for r in rows:
+            for i, (_, kind) in enumerate(self.columns):
+                value = r[i] if i < len(r) else None
+                self._buffer[i].append(_CONVERTERS[kind](value))
+            self._buffered += 1
+            if self._buffered >= self.row_group_rows:
+                self.flush()
+
+    def _open_writer(self, pa, pq, schema):
+        if self._writer is not None:
+            return
+
+        folder = os.path.join(
+            self.root, f"format={self.format_type}", f"ingest_date={date.today().isoformat()}"
+        )
+        os.makedirs(folder, exist_ok=True)
+        name = f"part-{datetime.now().strftime('%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        self._final_path = os.path.join(folder, name)
+        self._tmp_path = os.path.join(folder, f".{name}.tmp")
+        self._writer = pq.ParquetWriter(self._tmp_path, schema, compression="snappy")
+
+    def flush(self):
+        '''Ghi phần đang gom thành 1 row group'''
+        if not self._buffered:
+            return
+        pa, pq = _load_pyarrow()
+        schema = pa.schema([(name, _arrow_type(pa, kind)) for name, kind in self.columns])
+        arrays = [
+            pa.array(values, type=_arrow_type(pa, kind))
+            for values, (_, kind) in zip(self._buffer, self.columns)
+        ]
+        table = pa.Table.from_arrays(arrays, schema=schema)
+
+        self._open_writer(pa, pq, schema)
+        self._writer.write_table(table, row_group_size=self._buffered)
+
+        self._part_rows += self._buffered
+        self._part_groups += 1
+        self._buffer = [[] for _ in self.columns]
+        self._buffered = 0
+
+    def commit(self):
+        '''Publish mọi rows đã nhận (workbook vừa lưu xong): ghi nốt row group, đóng + đổi tên part'''
+        self.flush()
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp_path, self._final_path)
+        self.files.append(self._final_path)
+        self.rows_written += self._part_rows
+        self.row_groups += self._part_groups
+        self._part_rows = 0
+        self._part_groups = 0
+
+    def discard(self):
+        '''Bỏ rows chưa commit (buffer + part đang ghi)'''
+        self._buffer = [[] for _ in self.columns]
+        self._buffered = 0
+        self._part_rows = 0
+        self._part_groups = 0
+        if self._writer is None:
+            return
+        try:
+            self._writer.close()
+        finally:
+            self._writer = None
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+
+    def close(self):
+        '''Đóng sink - phần chưa commit bị bỏ'''
+        self.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def stats(self):
+        return {
+            'rows_written': self.rows_written,
+            'row_groups': self.row_groups,
+            'files': len(self.files)
+        }
+
+def open_parquet_sink(format_type):
+    '''Sink Parquet cho cả batch, None nếu tắt hoặc chưa cài pyarrow'''
+    if not PARQUET_ENABLED:
+        return None
+    if not is_parquet_available():
+        print("⚠️ Chưa cài pyarrow - bỏ qua xuất Parquet")
+        return None
+    return ParquetSink(format_type)
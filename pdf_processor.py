@@ -3,32 +3,12 @@ import os
 from datetime import datetime
 from typing import List, Dict, Optional
 
-import pdfplumber
-import pytesseract
 from excel_handler import append_excel
+from ocr_engine import extract_text_with_ocr
 
-def pdf_to_text(pdf_path):
-    '''Trích xuất text từ PDF'''
-    text = ""
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-    except:
-        pass
-    
-    if len(text.strip()) < 50:
-        try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    img = page.to_image(resolution=300).original
-                    text += pytesseract.image_to_string(img, lang="eng") + "\n"
-        except:
-            pass
-    
-    return text
+def pdf_to_text(pdf_path, log_callback=None):
+    '''Trích xuất text từ PDF - chỉ OCR những trang cần (trang scan / text hỏng)'''
+    return extract_text_with_ocr(pdf_path, log_callback)
 
 def is_number(s):
     '''Kiểm tra có phải số không'''
@@ -212,9 +192,12 @@ def extract_items_smart(text: str) -> List[Dict]:
     
     return items
 
-def process_pdf(pdf_path, log_callback=None, debug=False):
-    '''Xử lý một file PDF'''
-    filename = os.path.basename(pdf_path)
+def extract_pdf_rows(pdf_path, log_callback=None, debug=False, filename=None):
+    '''
+    Trích xuất các dòng Excel từ một file PDF (không ghi Excel)
+    - pdf_path: đường dẫn, file-like hoặc bytes (khi đó cần truyền filename)
+    '''
+    filename = filename or os.path.basename(pdf_path)
     
     def log(msg):
         if log_callback:
@@ -222,7 +205,7 @@ def process_pdf(pdf_path, log_callback=None, debug=False):
     
     log(f"Đang xử lý: {filename}")
     
-    text = pdf_to_text(pdf_path)
+    text = pdf_to_text(pdf_path, log_callback)
     
     if debug and len(text.strip()) >= 20:
         log(f"  📝 Debug - Text preview (first 800 chars):")
@@ -272,6 +255,12 @@ def process_pdf(pdf_path, log_callback=None, debug=False):
             item["extended_cost"]
         ])
     
+    return rows
+
+def process_pdf(pdf_path, log_callback=None, debug=False, filename=None):
+    '''Xử lý một file PDF'''
+    rows = extract_pdf_rows(pdf_path, log_callback, debug, filename)
+    
     if append_excel(rows):
         return len(rows)
     else:
@@ -2,32 +2,13 @@ import re
 import os
 from datetime import datetime
 from typing import List, Dict, Optional
-import pdfplumber
-import pytesseract
 from excel_handler_format2 import append_excel_format2
+from ocr_engine import extract_text_with_ocr
+from pdf_session import PDFSession, use_session
 
-def pdf_to_text(pdf_path):
-    '''Trích xuất text từ PDF (backup method)'''
-    text = ""
-    try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-    except:
-        pass
-    
-    if len(text.strip()) < 50:
-        try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    img = page.to_image(resolution=300).original
-                    text += pytesseract.image_to_string(img, lang="eng") + "\n"
-        except:
-            pass
-    
-    return text
+def pdf_to_text(pdf_path, log_callback=None):
+    '''Trích xuất text từ PDF (backup method) - chỉ OCR những trang cần (trang scan / text hỏng)'''
+    return extract_text_with_ocr(pdf_path, log_callback)
 
 def clean_value(val):
     '''Làm sạch giá trị từ bảng'''
@@ -91,11 +72,12 @@ def to_decimal(val, is_currency=False):
     except:
         return 0
 
-def extract_header_from_table(pdf_path) -> Dict:
+def extract_header_from_table(pdf_source) -> Dict:
     '''
     Extract header info từ 2 bảng đầu tiên
     Table 1: Order No, Order Date, Supplier Code, Com.Contract, Ad.Ch
     Table 2: Ordered By, Delivered To, For Store, By Supplier
+    pdf_source: đường dẫn PDF hoặc PDFSession đang mở
     '''
     header = {
         "order_no": "",
@@ -108,9 +90,8 @@ def extract_header_from_table(pdf_path) -> Dict:
     }
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            page = pdf.pages[0]
-            tables = page.extract_tables()
+        with use_session(pdf_source) as session:
+            tables = session.get_tables(0)
             
             if not tables or len(tables) < 2:
                 return header
@@ -190,18 +171,18 @@ def extract_header_from_table(pdf_path) -> Dict:
     
     return header
 
-def extract_items_from_table(pdf_path) -> List[Dict]:
+def extract_items_from_table(pdf_source) -> List[Dict]:
     '''
     Extract items từ bảng chính (Table 3)
     Required columns: Article, Article Desc, OU Type, LV, SKU/OU, OU Qty, 
                       Free Qty, Net Purchase Price, Unit, Total Net Purchase Price
+    pdf_source: đường dẫn PDF hoặc PDFSession đang mở
     '''
     items = []
     
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                tables = page.extract_tables()
+        with use_session(pdf_source) as session:
+            for page_num, tables in session.iter_tables():
                 
                 # The items table is typically table index 2 (third table)
                 # But we'll search for it by checking for "Article" header
@@ -275,9 +256,12 @@ def extract_items_from_table(pdf_path) -> List[Dict]:
     
     return items
 
-def process_pdf_format2(pdf_path, log_callback=None, debug=False):
-    '''Process PDF format 2 - Complete table-based extraction with validation'''
-    filename = os.path.basename(pdf_path)
+def extract_pdf_rows_format2(pdf_path, log_callback=None, debug=False, filename=None):
+    '''
+    Extract Excel rows from a format 2 PDF (no Excel write)
+    - pdf_path: path, file-like or bytes (pass filename in that case)
+    '''
+    filename = filename or os.path.basename(pdf_path)
     
     def log(msg):
         if log_callback:
@@ -285,8 +269,12 @@ def process_pdf_format2(pdf_path, log_callback=None, debug=False):
     
     log(f"[Format 2] Processing: {filename}")
     
-    # Step 1: Extract header from first 2 tables
-    header = extract_header_from_table(pdf_path)
+    # Step 1 + 2: Mở PDF 1 lần - header và items dùng chung kết quả extract_tables()
+    with PDFSession(pdf_path) as session:
+        # Header từ 2 bảng đầu tiên
+        header = extract_header_from_table(session)
+        # Items từ bảng chính (bỏ qua nếu không có Order No)
+        items = extract_items_from_table(session) if header["order_no"] else []
     
     if debug:
         log(f"  🔍 Debug - Header extracted:")
@@ -302,9 +290,6 @@ def process_pdf_format2(pdf_path, log_callback=None, debug=False):
         log(f"  ⚠️ Order No not found in tables")
         raise Exception("Order No not found")
     
-    # Step 2: Extract items from main table
-    items = extract_items_from_table(pdf_path)
-    
     if not items:
         log(f"  ⚠️ No items found in tables")
         raise Exception("No items found")
@@ -352,6 +337,12 @@ def process_pdf_format2(pdf_path, log_callback=None, debug=False):
             item["total_net_price"]     # TotalNetPurchasePrice
         ])
     
+    return rows
+
+def process_pdf_format2(pdf_path, log_callback=None, debug=False, filename=None):
+    '''Process PDF format 2 - Complete table-based extraction with validation'''
+    rows = extract_pdf_rows_format2(pdf_path, log_callback, debug, filename)
+    
     # Step 4: Save to Excel
     if append_excel_format2(rows):
         return len(rows)
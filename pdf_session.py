@@ -0,0 +1,89 @@
+import io
+from contextlib import contextmanager
+
+import pdfplumber
+
+class PDFSession:
+    '''
+    Mở PDF MỘT LẦN và cache kết quả parse theo từng trang.
+    Header + items (Format 2) dùng chung cùng một bảng đã extract,
+    không phải mở lại file và parse lại layout pdfminer.
+    pdf_path: đường dẫn, file-like (BytesIO...) hoặc bytes (file tải thẳng vào RAM)
+    '''
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self._pdf = None
+        self._tables = {}  # page_num -> list tables
+        self._texts = {}   # page_num -> text
+
+    def open(self):
+        '''Mở file PDF (chỉ mở 1 lần)'''
+        if self._pdf is None:
+            source = self.pdf_path
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                source = io.BytesIO(source)
+            self._pdf = pdfplumber.open(source)
+        return self
+
+    def close(self):
+        '''Đóng file PDF và giải phóng cache'''
+        if self._pdf is not None:
+            try:
+                self._pdf.close()
+            except:
+                pass
+            self._pdf = None
+        self._tables.clear()
+        self._texts.clear()
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @property
+    def pages(self):
+        return self.open()._pdf.pages
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    def get_page(self, page_num):
+        return self.pages[page_num]
+
+    def get_tables(self, page_num):
+        '''extract_tables() cho 1 trang - chỉ chạy 1 lần mỗi trang'''
+        if page_num not in self._tables:
+            self._tables[page_num] = self.get_page(page_num).extract_tables() or []
+        return self._tables[page_num]
+
+    def get_text(self, page_num):
+        '''extract_text() cho 1 trang - chỉ chạy 1 lần mỗi trang'''
+        if page_num not in self._texts:
+            self._texts[page_num] = self.get_page(page_num).extract_text() or ""
+        return self._texts[page_num]
+
+    def iter_tables(self):
+        '''Duyệt (page_num, tables) qua tất cả các trang'''
+        for page_num in range(self.page_count):
+            yield page_num, self.get_tables(page_num)
+
+@contextmanager
+def use_session(source):
+    '''
+    Nhận đường dẫn PDF / file-like / bytes hoặc PDFSession có sẵn.
+    Chỉ đóng session nếu chính hàm này mở nó.
+    '''
+    if isinstance(source, PDFSession):
+        yield source.open()
+        return
+
+    session = PDFSession(source)
+    try:
+        yield session.open()
+    finally:
+        session.close()
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from config import STATE_DB_FILE
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filename TEXT NOT NULL,
+    file_hash TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    queued_at TEXT,
+    started_at TEXT,
+    finished_at TEXT,
+    duration REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_files_hash ON files(file_hash) WHERE file_hash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_files_filename ON files(filename);
+CREATE INDEX IF NOT EXISTS idx_files_status ON files(status, finished_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+class ProcessingStateStore:
+    '''
+    Trạng thái xử lý từng file trong SQLite (WAL):
+    status (queued/running/done/failed), lỗi, thời gian, số lần thử.
+    Mọi tra cứu đều qua index → không phụ thuộc độ dài lịch sử.
+    '''
+
+    def __init__(self, db_path=STATE_DB_FILE):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        '''Mỗi thread 1 connection (sqlite3 connection không dùng chung được giữa thread)'''
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ===== Meta =====
+
+    def get_meta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute(
+                "INSERT INTO meta(key, value) VALUES(?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+            conn.commit()
+
+    # ===== Ghi trạng thái =====
+
+    def _find_row_id(self, conn, filename, file_hash):
+        '''Tìm row theo hash (ưu tiên), nếu không có thì theo tên file chưa có hash'''
+        if file_hash:
+            row = conn.execute("SELECT id FROM files WHERE file_hash = ?", (file_hash,)).fetchone()
+            if row:
+                return row[0]
+        row = conn.execute(
+            "SELECT id FROM files WHERE filename = ? AND file_hash IS NULL ORDER BY id DESC LIMIT 1",
+            (filename,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _upsert(self, filename, file_hash, **fields):
+        with self._write_lock:
+            conn = self._conn()
+            row_id = self._find_row_id(conn, filename, file_hash)
+
+            if row_id is None:
+                fields.setdefault("status", STATUS_QUEUED)
+                fields["filename"] = filename
+                fields["file_hash"] = file_hash
+                columns = ", ".join(fields)
+                marks = ", ".join("?" for _ in fields)
+                conn.execute(f"INSERT INTO files({columns}) VALUES({marks})", tuple(fields.values()))
+            else:
+                fields["filename"] = filename
+                if file_hash:
+                    fields["file_hash"] = file_hash
+                assignments = []
+                values = []
+                for column, value in fields.items():
+                    if column == "attempts":
+                        assignments.append("attempts = attempts + ?")
+                    else:
+                        assignments.append(f"{column} = ?")
+                    values.append(value)
+                values.append(row_id)
+                conn.execute(f"UPDATE files SET {', '.join(assignments)} WHERE id = ?", values)
+
+            conn.commit()
+
+    def mark_queued(self, filename, file_hash=None):
+        self._upsert(filename, file_hash, status=STATUS_QUEUED, queued_at=_now(), error=None)
+
+    def mark_running(self, filename, file_hash=None):
+        self._upsert(filename, file_hash, status=STATUS_RUNNING, started_at=_now(), attempts=1)
+
+    def mark_done(self, filename, file_hash=None, duration=None):
+        self._upsert(
+            filename, file_hash,
+            status=STATUS_DONE, finished_at=_now(), duration=duration, error=None
+        )
+
+    def mark_failed(self, filename, error=None, file_hash=None, duration=None):
+        self._upsert(
+            filename, file_hash,
+            status=STATUS_FAILED, finished_at=_now(), duration=duration,
+            error=error or "Lỗi không xác định"
+        )
+
+    # ===== Tra cứu =====
+
+    def is_hash_done(self, file_hash):
+        row = self._conn().execute(
+            "SELECT 1 FROM files WHERE file_hash = ? AND status = ?",
+            (file_hash, STATUS_DONE)
+        ).fetchone()
+        return row is not None
+
+    def is_filename_done(self, filename):
+        row = self._conn().execute(
+            "SELECT 1 FROM files WHERE filename = ? AND status = ? LIMIT 1",
+            (filename, STATUS_DONE)
+        ).fetchone()
+        return row is not None
+
+    def count_status(self, status):
+        row = self._conn().execute("SELECT COUNT(*) FROM files WHERE status = ?", (status,)).fetchone()
+        return row[0]
+
+    def iter_status(self, status):
+        '''Duyệt (finished_at, filename, error) theo thứ tự thời gian'''
+        cursor = self._conn().execute(
+            "SELECT finished_at, filename, error FROM files WHERE status = ? ORDER BY finished_at, id",
+            (status,)
+        )
+        for row in cursor:
+            yield row
+
+    def clear_status(self, status):
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("DELETE FROM files WHERE status = ?", (status,))
+            conn.commit()
+
+    # ===== Export text log =====
+
+    def export_log(self, status, file_path):
+        '''Sinh lại success_log.txt / error_log.txt từ store'''
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"# Exported from {os.path.basename(self.db_path)} at {_now()}\n")
+            for finished_at, filename, error in self.iter_status(status):
+                if status == STATUS_FAILED:
+                    f.write(f"[{finished_at}] {filename} - {error}\n")
+                else:
+                    f.write(f"[{finished_at}] {filename}\n")
+        os.replace(tmp_path, file_path)
+
+    # ===== Import lịch sử cũ =====
+
+    def import_legacy(self, success_file, error_file):
+        '''Import 1 lần từ success_log / error_log cũ'''
+        if self.get_meta("legacy_imported"):
+            return
+
+        rows = []
+
+        def parse_line(line):
+            # [2024-01-01 10:00:00] filename[ - error]
+            if not line.startswith('[') or ']' not in line:
+                return None
+            timestamp, rest = line[1:].split(']', 1)
+            return timestamp.strip(), rest.strip()
+
+        if os.path.exists(success_file):
+            with open(success_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parsed = parse_line(line.rstrip("\n"))
+                    if parsed and parsed[1]:
+                        rows.append((parsed[1], None, STATUS_DONE, None, parsed[0]))
+
+        if os.path.exists(error_file):
+            with open(error_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parsed = parse_line(line.rstrip("\n"))
+                    if parsed and parsed[1]:
+                        filename, _, error = parsed[1].partition(" - ")
+                        rows.append((filename, None, STATUS_FAILED, error or None, parsed[0]))
+
+        with self._write_lock:
+            conn = self._conn()
+            conn.executemany(
+                "INSERT INTO files(filename, file_hash, status, error, finished_at, attempts) "
+                "VALUES(?, ?, ?, ?, ?, 1)",
+                rows
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta(key, value) VALUES('legacy_imported', ?)",
+                (_now(),)
+            )
+            conn.commit()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_state_store():
+    '''Store dùng chung cho cả app'''
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ProcessingStateStore()
+        return _store